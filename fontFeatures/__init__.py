@@ -344,7 +344,7 @@ class Rule:
         """Computes any text that needs to go in the feature file header."""
         return []
 
-    from .shaperLib.Rule import would_apply_at_position, pre_post_context_matches
+    from .shaperLib.Rule import would_apply_at_position, pre_post_context_matches, compiled_slots
     from .xmlLib.Rule import fromXML, toXML, _makeglyphslots, _slotArray
 
 class Substitution(Rule):
@@ -403,7 +403,7 @@ class Substitution(Rule):
         return i | o | b | a
 
     from .feaLib.Substitution import asFeaAST
-    from .shaperLib.Substitution import shaper_inputs, _do_apply
+    from .shaperLib.Substitution import shaper_inputs, _do_apply, compiled_mapping
     from .xmlLib.Substitution import _toXML, fromXML
 
 
@@ -543,7 +543,7 @@ class Attachment(Rule):
         return self.base_name == "cursive_entry" or self.base_name == "entry" # XXX
 
     from .feaLib.Attachment import asFeaAST, feaPreamble
-    from .shaperLib.Attachment import shaper_inputs, _do_apply, would_apply_at_position
+    from .shaperLib.Attachment import shaper_inputs, _do_apply, would_apply_at_position, compiled_anchors
     from .xmlLib.Attachment import _toXML, fromXML
 
     @property
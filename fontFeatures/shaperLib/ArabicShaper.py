@@ -1,5 +1,5 @@
 from .BaseShaper import BaseShaper
-from youseedee import ucd_data
+from fontFeatures.shaperLib.UnicodeProperties import unicode_property
 
 
 jts = {
@@ -49,17 +49,17 @@ class ArabicShaper(BaseShaper):
         prev_item = None
         for item in self.buffer.items:
             item.arabic_joining = "NONE"
-            ucd = ucd_data(item.codepoint)
-            joining = ucd.get("Joining_Type")
+            joining = unicode_property(item.codepoint, "Joining_Type")
             if not joining:
-                if ucd.get("General_Category") in ["Mn", "Cf", "Em"]:
+                if unicode_property(item.codepoint, "General_Category") in ["Mn", "Cf", "Em"]:
                     joining = "T"
                 else:
                     joining = "U"
             if joining == "T": continue
             if joining == "C": joining = "D"  # Mongolian
-            if ucd.get("Joining_Group") == "ALAPH": joining = "ALAPH"
-            if ucd.get("Joining_Group") == "DALATH RISH": joining = "DALATH_RISH"
+            group = unicode_property(item.codepoint, "Joining_Group")
+            if group == "ALAPH": joining = "ALAPH"
+            if group == "DALATH RISH": joining = "DALATH_RISH"
             prev, this, state = state_table[state][jts[joining]]
             if prev_item:
               prev_item.arabic_joining = prev
@@ -72,7 +72,7 @@ class ArabicShaper(BaseShaper):
             if f not in self.plan.fontfeatures.features:
                 continue
             for item in self.buffer.items:
-                item.feature_masks[f] = item.arabic_joining != f
+                item.mask_feature(f, item.arabic_joining != f)
 
     def mongolian_variation_selectors(self):
         for ix,item in enumerate(self.buffer.items):
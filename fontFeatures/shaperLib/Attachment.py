@@ -1,57 +1,93 @@
 import logging
 from fontFeatures import Rule
 
+logger = logging.getLogger("fontFeatures.shaperLib")
+
 
 def shaper_inputs(self):
     return [self.bases.keys(), self.marks.keys()]
 
 def find_base_backwards(self, buf, ix):
-    start_ix = ix
-    ix = ix - 1
-    while ix >= 0:
-        if buf[ix].glyph in self.bases.keys():
-            # Check for unhelpful stuff in between
-            my_category = buf[ix].category[0]
-            for i in range(ix+1, start_ix):
-                if buf[i].category[0] == my_category or buf[i].category[0] == "unknown":
-                    # Oops, we skipped over another %s to get here
-                    return None
-            return ix
-        ix = ix - 1
-    return None
+    # Rather than searching back from each mark, we follow the routine
+    # forward through the mask, remembering the last glyph which could be
+    # our base, the last unknown glyph and the last glyph of each category.
+    # The base is no good if we'd have to skip over an unknown glyph or
+    # another glyph of its category to get to it.
+    search = buf.base_searches.get(self)
+    if search is None or search[0] is not buf.mask or search[1] > ix:
+        search = buf.base_searches[self] = [buf.mask, 0, None, -1, {}]
+    mask, scanned, base, unknown, last = search
+    items = buf.items
+    for j in range(scanned, ix):
+        item = items[mask[j]]
+        category = item.category[0]
+        if item.glyph in self.bases:
+            base = j
+        if category == "unknown":
+            unknown = j
+        last[category] = j
+    search[1:4] = ix, base, unknown
+    if base is None or unknown > base:
+        return None
+    if last[items[mask[base]].category[0]] != base:
+        # Oops, we skipped over another of those to get here
+        return None
+    return base
 
-def would_apply_at_position(self, buf, ix, namedclasses={}):
-    from fontFeatures.shaperLib.Rule import _expand_slot
+def compiled_anchors(self, namedclasses={}):
+    """Returns the mark and base glyphs of this rule as frozensets of glyph
+    names, with named classes expanded.
+
+    The result is cached on the rule, and recomputed if the marks or bases
+    are replaced or grow, or the named classes they use are redefined."""
+    from fontFeatures.shaperLib.Rule import _expand_slot, _referenced_classes, _classes_current
 
-    logging.getLogger("fontFeatures.shaperLib").debug("Testing if %s would apply at position %i" % (self.asFea(), ix))
-    marks = _expand_slot(self.marks.keys(), namedclasses)
-    bases = _expand_slot(self.bases.keys(), namedclasses)
+    cached = getattr(self, "_compiled_anchors", None)
+    if cached:
+        marks, bases, mark_count, base_count, classes, referenced, compiled = cached
+        if marks is self.marks and bases is self.bases \
+            and mark_count == len(marks) and base_count == len(bases) \
+            and classes is namedclasses and _classes_current(referenced, namedclasses):
+            return compiled
+    referenced = _referenced_classes([self.marks.keys(), self.bases.keys()], namedclasses)
+    compiled = (
+        frozenset(_expand_slot(self.marks.keys(), namedclasses)),
+        frozenset(_expand_slot(self.bases.keys(), namedclasses)),
+    )
+    self._compiled_anchors = (self.marks, self.bases, len(self.marks), len(self.bases), namedclasses, referenced, compiled)
+    return compiled
+
+def would_apply_at_position(self, buf, ix, namedclasses={}):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Testing if %s would apply at position %i", self.asFea(), ix)
 
     if self.is_cursive:
         if ix == 0:
-            logging.getLogger("fontFeatures.shaperLib").debug(" * No, it has no adjacent glyph")
+            logger.debug(" * No, it has no adjacent glyph")
             return False
-        if buf[ix].glyph in marks and buf[ix-1].glyph in bases:
-            logging.getLogger("fontFeatures.shaperLib").debug(" * No, %s/%s is not a pair" % (buf[ix].glyph, buf[ix-1].glyph))
-        logging.getLogger("fontFeatures.shaperLib").debug(" * Yes, %s/%s is a pair" % (buf[ix].glyph, buf[ix-1].glyph))
+        if logger.isEnabledFor(logging.DEBUG):
+            marks, bases = compiled_anchors(self, namedclasses)
+            if buf[ix].glyph in marks and buf[ix-1].glyph in bases:
+                logger.debug(" * No, %s/%s is not a pair", buf[ix].glyph, buf[ix-1].glyph)
+        logger.debug(" * Yes, %s/%s is a pair", buf[ix].glyph, buf[ix-1].glyph)
         return True
 
-
+    marks, bases = compiled_anchors(self, namedclasses)
 
     # Mark to base is a bit different, as multiple marks can attach to a base
     # so we search backwards for the preceding base glyph
     # XXX mark to mark
     if buf[ix].glyph not in marks:
-        logging.getLogger("fontFeatures.shaperLib").debug(" * No, %s is not in our mark list" % (buf[ix].glyph))
+        logger.debug(" * No, %s is not in our mark list", buf[ix].glyph)
         return False
     base_ix = find_base_backwards(self, buf, ix)
     if base_ix is None:
-        logging.getLogger("fontFeatures.shaperLib").debug(" * No, I couldn't find a base glyph")
+        logger.debug(" * No, I couldn't find a base glyph")
         return False
     if buf[base_ix].glyph not in bases:
-        logging.getLogger("fontFeatures.shaperLib").debug(" * No, %s is not in our base list" % buf[base_ix].glyph)
+        logger.debug(" * No, %s is not in our base list", buf[base_ix].glyph)
         return False
-    logging.getLogger("fontFeatures.shaperLib").debug(" * Yes, attaching mark %s/%i to %s/%i" % (buf[ix].glyph, ix, buf[base_ix].glyph, base_ix))
+    logger.debug(" * Yes, attaching mark %s/%i to %s/%i", buf[ix].glyph, ix, buf[base_ix].glyph, base_ix)
     return True
 
 def _do_apply_cursive(self, buf, ix):
@@ -1,7 +1,7 @@
 from fontFeatures.shaperLib.Buffer import Buffer, BufferItem
 from copy import copy
 import unicodedata
-from youseedee import ucd_data
+from fontFeatures.shaperLib.UnicodeProperties import unicode_property
 from fontFeatures import RoutineReference
 
 
@@ -28,7 +28,6 @@ class BaseShaper:
         self.features = features
 
     def shape(self):
-        self.plan.fontfeatures.resolveAllRoutines()
         # self.buffer.set_unicode_props()
         # self.insert_dotted_circles()
         # self.buffer.form_clusters()
@@ -66,9 +65,7 @@ class BaseShaper:
 
         # Some fix-ups from hb-ot-shape-normalize
         for item in self.buffer.items:
-            if ucd_data(item.codepoint)[
-                "General_Category"
-            ] == "Zs" and self.font.glyphForCodepoint(0x20, False):
+            if unicode_property(item.codepoint, "General_Category") == "Zs" and self.font.glyphForCodepoint(0x20, False):
                 item.codepoint = 0x20
                 # Harfbuzz adjusts the width here, in _hb_ot_shape_fallback_spaces
             if item.codepoint == 0x2011 and self.font.glyphForCodepoint(0x2010, False):
@@ -88,65 +85,83 @@ class BaseShaper:
         #         i.position.xAdvance = 0
         # zero width default ignorables
         self.zero_width_default_ignorables()
-        for i in range(0,len(self.buffer.items)):
-            self.propagate_attachment_offsets(i)
+        self.propagate_attachment_offsets()
+
+    def propagate_attachment_offsets(self):
+        """Adds the offset of the glyph each glyph is attached to into its
+        own placement. Each chain of attachments is followed to its end
+        first and then resolved back towards its start, so every glyph is
+        visited once."""
+        items = self.buffer.items
+        # Running totals of the advances, for the distance between a mark
+        # and its base
+        x_advances, y_advances = [0], [0]
+        for item in items:
+            x_advances.append(x_advances[-1] + item.position.xAdvance)
+            y_advances.append(y_advances[-1] + (item.position.yAdvance or 0))
+        for i in range(0, len(items)):
+            chain = []
+            while hasattr(items[i], "attach_type") and items[i].attach_chain:
+                j = i + items[i].attach_chain
+                items[i].attach_chain = None
+                if j >= len(items):
+                    break
+                chain.append((i, j))
+                i = j
+            for i, j in reversed(chain):
+                position, attached_to = items[i].position, items[j].position
+                if items[i].attach_type == "cursive":
+                    position.yPlacement = (position.yPlacement or 0) + (attached_to.yPlacement or 0) # XXX Horizontal only
+                    continue
+                position.xPlacement += attached_to.xPlacement or 0
+                position.yPlacement += attached_to.yPlacement or 0
+                assert j < i
+                if self.buffer.direction == "LTR":
+                    position.xPlacement -= x_advances[i] - x_advances[j]
+                    position.yPlacement -= y_advances[i] - y_advances[j]
+                else:
+                    position.xPlacement += x_advances[i+1] - x_advances[j+1]
+                    position.yPlacement += y_advances[i+1] - y_advances[j+1]
 
-    def propagate_attachment_offsets(self, i):
-        if not hasattr(self.buffer.items[i], "attach_type"):
-            return
-        attach_type = self.buffer.items[i].attach_type
-        attach_chain = self.buffer.items[i].attach_chain
-        if not attach_chain:
-            return
-        self.buffer.items[i].attach_chain = None
-        j = i + attach_chain
-        if j >= len(self.buffer.items):
-            return
-        self.propagate_attachment_offsets(j)
-        if attach_type == "cursive":
-            self.buffer.items[i].position.yPlacement = (self.buffer.items[i].position.yPlacement or 0) + (self.buffer.items[j].position.yPlacement or 0) # XXX Horizontal only
-        else:
-            self.buffer.items[i].position.xPlacement += self.buffer.items[j].position.xPlacement or 0
-            self.buffer.items[i].position.yPlacement += self.buffer.items[j].position.yPlacement or 0
-            assert j < i
-            if self.buffer.direction == "LTR":
-                for k in range(j,i):
-                    self.buffer.items[i].position.xPlacement -= self.buffer.items[k].position.xAdvance
-                    self.buffer.items[i].position.yPlacement -= self.buffer.items[k].position.yAdvance or 0
-            else:
-                for k in range(j+1,i+1):
-                    self.buffer.items[i].position.xPlacement += self.buffer.items[k].position.xAdvance
-                    self.buffer.items[i].position.yPlacement += self.buffer.items[k].position.yAdvance or 0
 
+    def lookups_for_features(self, features):
+        lookups = []
+        for f in features:
+            if f not in self.plan.fontfeatures.features:
+                continue
+
+            routines = self.plan.fontfeatures.features[f]
+            routines = [x.routine if isinstance(x, RoutineReference) else x for x in routines]
+            lookups.extend(
+                [(routine, f) for routine in self._filter_by_lang(routines)]
+            )
+        return lookups
 
     def _run_stage(self, current_stage):
         self.plan.msg("Running %s stage" % current_stage)
-        self.plan.fontfeatures.hoist_languages()
-        for stage in self.plan.stages:
-            lookups = []
-            if isinstance(stage, list):  # Features
-                for f in stage:
-                    if f not in self.plan.fontfeatures.features:
-                        continue
-
-                    routines = self.plan.fontfeatures.features[f]
-                    routines = [x.routine if isinstance(x, RoutineReference) else x for x in routines]
-                    lookups.extend(
-                        [(routine, f) for routine in self._filter_by_lang(routines)]
-                    )
+        shape_plan = self.plan.shape_plan
+        for stage, lookups in zip(shape_plan.stages, shape_plan.lookups):
+            if isinstance(stage, tuple):  # Features
                 self.plan.msg("Processing features: %s" % ",".join(stage))
+                # Pauses may have changed anything, so start afresh
+                self.buffer.invalidate_masks()
+                self.buffer.start_glyph_digest()
+                tracing = self.plan.tracing()
                 for r, feature in lookups:
-                    self.plan.msg(
-                        "Before %s (%s)" % (r.name, feature), buffer=self.buffer
-                    )
+                    if tracing:
+                        self.plan.msg(
+                            "Before %s (%s)" % (r.name, feature), buffer=self.buffer
+                        )
                     r.apply_to_buffer(self.buffer, stage=current_stage, feature=feature, namedclasses=self.plan.fontfeatures.namedClasses)
-                    self.plan.msg(
-                        "After %s (%s)" % (r.name, feature), buffer=self.buffer
-                    )
+                    if tracing:
+                        self.plan.msg(
+                            "After %s (%s)" % (r.name, feature), buffer=self.buffer
+                        )
             else:
                 # It's a pause. We only support GSUB pauses.
                 if current_stage == "sub":
-                    stage(current_stage)
+                    stage(self, current_stage)
+        self.buffer.stop_glyph_digest()
 
     def _filter_by_lang(self, routines):
         script = self.script_to_opentype.get(self.buffer.script,"DFLT")
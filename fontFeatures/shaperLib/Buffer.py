@@ -1,7 +1,8 @@
 from dataclasses import dataclass
-from fontFeatures import ValueRecord
+from bisect import bisect_left
+from fontFeatures.shaperLib.Face import Face
 from glyphtools import get_glyph_metrics
-from youseedee import ucd_data
+from fontFeatures.shaperLib.UnicodeProperties import unicode_property
 import sys
 import warnings
 
@@ -17,13 +18,88 @@ def _add_value_records(vr1, vr2):
         vr1.yAdvance = (vr1.yAdvance or 0) + (vr2.yAdvance or 0)
 
 
+class Position:
+    """The position of a glyph in the buffer. This carries the same fields as
+    a ValueRecord, without the rest of the AST node's baggage."""
+
+    __slots__ = ("xPlacement", "yPlacement", "xAdvance", "yAdvance")
+
+    def __init__(self, xPlacement=None, yPlacement=None, xAdvance=None, yAdvance=None):
+        self.xPlacement = xPlacement
+        self.yPlacement = yPlacement
+        self.xAdvance = xAdvance
+        self.yAdvance = yAdvance
+
+    def __copy__(self):
+        return Position(self.xPlacement, self.yPlacement, self.xAdvance, self.yAdvance)
+
+    def __repr__(self):
+        return "Position(%s, %s, %s, %s)" % (self.xPlacement, self.yPlacement, self.xAdvance, self.yAdvance)
+
+
+_missing = object()
+_categories = {}
+
+# Each feature tag which items can be masked from gets its own bit in
+# BufferItem.feature_masks; a set bit hides the item from the lookups of
+# that feature.
+_feature_bits = {}
+
+
+def feature_bit(feature):
+    bit = _feature_bits.get(feature)
+    if bit is None:
+        bit = _feature_bits[feature] = 1 << len(_feature_bits)
+    return bit
+
+
 @dataclass
 class BufferItem:
     # codepoint: int
     # glyph: str
-    # position: ValueRecord
+    # position: Position
     # category: str
 
+    # The attributes every mapped glyph has. Attributes are only set once
+    # they mean something, so code can use hasattr to check whether an item
+    # has been mapped yet. Complex shapers' own attributes (syllable_index,
+    # arabic_joining and so on) live in the instance dictionary.
+    __slots__ = (
+        "codepoint",
+        "glyph",
+        "gid",
+        "position",
+        "category",
+        "feature_masks",
+        "substituted",
+        "ligated",
+        "multiplied",
+        "__dict__",
+    )
+
+    def __copy__(self):
+        new = BufferItem.__new__(BufferItem)
+        try:
+            new.codepoint = self.codepoint
+            new.glyph = self.glyph
+            new.gid = self.gid
+            new.position = self.position
+            new.category = self.category
+            new.feature_masks = self.feature_masks
+            new.substituted = self.substituted
+            new.ligated = self.ligated
+            new.multiplied = self.multiplied
+        except AttributeError:
+            # Not mapped to a glyph yet
+            for attr in BufferItem.__slots__[:-1]:
+                value = getattr(self, attr, _missing)
+                if value is not _missing:
+                    setattr(new, attr, value)
+        extras = self.__dict__
+        if extras:
+            new.__dict__.update(extras)
+        return new
+
     def __repr__(self):
         s = ""
         if self.glyph:
@@ -45,7 +121,7 @@ class BufferItem:
         self = BufferItem()
         self.codepoint = codepoint
         self.glyph = None
-        self.feature_masks = {}
+        self.feature_masks = 0
         return self
 
     @classmethod
@@ -53,27 +129,35 @@ class BufferItem:
         self = BufferItem()
         self.codepoint = None
         self.glyph = glyph
-        self.feature_masks = {}
+        self.feature_masks = 0
         self.prep_glyph(font)
         return self
 
+    def mask_feature(self, feature, masked=True):
+        """Hides the item from the lookups of the given feature, or shows it
+        to them again if ``masked`` is False."""
+        if masked:
+            self.feature_masks |= feature_bit(feature)
+        else:
+            self.feature_masks &= ~feature_bit(feature)
+
     def map_to_glyph(self, font):
         if not self.glyph:
             self.glyph = font.glyphForCodepoint(self.codepoint)
         self.prep_glyph(font)
 
     def prep_glyph(self, font):
-        if self.glyph in font.glyphOrder:
-            self.gid = font.glyphOrder.index(self.glyph)
-        else:
-            self.gid = -1 # ?
+        if isinstance(self.glyph, str):
+            self.glyph = sys.intern(self.glyph)
+        face = Face.for_font(font)
+        self.gid = face.gid(self.glyph) # -1 if not in the glyph order
         self.substituted = False
         self.ligated = False
         self.multiplied = False
         self.recategorize(font)
         try:
-            self.position = ValueRecord(xAdvance=0)
-            self.position.xAdvance=font[self.glyph].width
+            self.position = Position(xAdvance=0)
+            self.position.xAdvance = face.advance(self.glyph)
         except Exception as e:
             if "pytest" in sys.modules:
                 # We tolerate broken fonts in pytest
@@ -83,9 +167,9 @@ class BufferItem:
 
     def recategorize(self, font):
         try:
-            self.category = (font[self.glyph].category, None)
-            if not self.category[0]:
-                self.category = ("unknown", None)
+            category = Face.for_font(font).category(self.glyph) or "unknown"
+            # Share one tuple between all glyphs of each category
+            self.category = _categories.get(category) or _categories.setdefault(category, (category, None))
         except Exception as e:
             warnings.warn("Error getting category: %s" % str(e))
             self._fallback_categorize()
@@ -95,7 +179,7 @@ class BufferItem:
             # Now what?
             self.category = ("unknown", None)
             return
-        genCat = ucd_data(self.codepoint).get("General_Category", "L")
+        genCat = unicode_property(self.codepoint, "General_Category", "L")
         if genCat[0] == "M":
             self.category = ("mark", None)
         elif genCat == "Ll":
@@ -119,7 +203,15 @@ class Buffer:
         self.fallback_glyph_classes = False
         self.items = []
         self.mask = []
+        self._masks = {}
+        self.touched = []
+        self.glyph_digest = None
+        # Progress of Attachment rules through the mask, reset whenever the
+        # items change
+        self.base_searches = {}
         self.flags = 0
+        self.markFilteringSet = None
+        self.markAttachmentSet = None
         self.current_feature_mask = None
         if glyphs:
             self.items = [BufferItem.new_glyph(g, font) for g in glyphs]
@@ -136,7 +228,7 @@ class Buffer:
         for u in self.items:
             # Guess segment properties
             if not self.script:
-                thisScript = ucd_data(u.codepoint)["Script"]
+                thisScript = unicode_property(u.codepoint, "Script")
                 if thisScript not in ["Common", "Unknown", "Inherited"]:
                     self.script = thisScript
         if not self.direction:
@@ -169,11 +261,19 @@ class Buffer:
         indexed = self.mask[key]
         if len(indexed) == 1:  # Easy
             self.items[indexed[0] : indexed[0] + 1] = value
+            self._patch_masks(indexed[0], indexed[0] + 1, len(value))
+            self.touched.extend(value)
+            if self.glyph_digest is not None:
+                self.glyph_digest.update(x.glyph for x in value)
             return
         if len(value) == 1:  # Also easy
             self.items[indexed[0]] = value[0]
             for i in reversed(indexed[1:]):
                 del self.items[i]
+            self._patch_masks(indexed[0], indexed[-1] + 1, indexed[-1] + 1 - indexed[0] - len(indexed) + 1)
+            self.touched.append(value[0])
+            if self.glyph_digest is not None:
+                self.glyph_digest.add(value[0].glyph)
             return
         else:
             raise ValueError("Too hard :-(")
@@ -184,8 +284,24 @@ class Buffer:
     def update(self):
         for g in self.items:
             g.recategorize(self.font)
+        self.touched = []
         self.recompute_mask()
 
+    def update_touched(self):
+        """Recategorizes only the items which have been replaced or changed
+        through the buffer since the last update, and patches the masks for
+        any whose category has changed."""
+        touched, self.touched = self.touched, []
+        for g in touched:
+            category = g.category
+            g.recategorize(self.font)
+            if g.category == category:
+                continue
+            for ix, item in enumerate(self.items):
+                if item is g:
+                    self._patch_masks(ix, ix + 1, 1)
+                    break
+
     def clear_mask(self):
         self.flags = 0
         self.markFilteringSet = None
@@ -196,53 +312,140 @@ class Buffer:
         self.flags = flags
         self.markFilteringSet = markFilteringSet
         self.markAttachmentSet = markAttachmentSet
-        self.recompute_mask()
+        self._select_mask()
+
+    def masked_index(self, ix):
+        """Returns the position in the current mask of the item at index
+        ``ix`` of ``items``, or None if the mask skips over it."""
+        i = bisect_left(self.mask, ix)
+        if i < len(self.mask) and self.mask[i] == ix:
+            return i
+        return None
 
     def recompute_mask(self):
-        mask = range(0, len(self.items))
+        """Recomputes the mask from scratch.
+
+        Masks are cached for each combination of flags, mark sets and feature,
+        and kept up to date as items are replaced through the buffer. Code
+        which rearranges ``items`` directly should call this afterwards."""
+        self.invalidate_masks()
+        self._select_mask()
+
+    def invalidate_masks(self):
+        """Forgets the cached masks, so that they are recomputed the next
+        time a mask is set."""
+        self._masks = {}
+        self.base_searches = {}
+
+    def _mask_key(self):
+        return (self.flags, id(self.markFilteringSet), id(self.markAttachmentSet), self.current_feature_mask)
+
+    def _select_mask(self):
         self.flags = self.flags or 0
-        if self.flags & 0x2:  # IgnoreBases
-            mask = list(filter(lambda ix: self.items[ix].category[0] != "base", mask))
-        if self.flags & 0x4:  # IgnoreLigatures
-            mask = list(
-                filter(lambda ix: self.items[ix].category[0] != "ligature", mask)
-            )
-        if self.flags & 0x8:  # IgnoreMarks
-            mask = list(filter(lambda ix: self.items[ix].category[0] != "mark", mask))
-        if self.flags & 0x10:  # UseMarkFilteringSet
-            mask = list(
-                filter(
-                    lambda ix: self.items[ix].category[0] != "mark"
-                    or self.items[ix].glyph in self.markFilteringSet,
-                    mask,
-                )
-            )
-        if self.flags & 0xFF00:  # MarkAttachmentType
-            mask = list(
-                filter(
-                    lambda ix: self.items[ix].category[0] != "mark"
-                    or self.items[ix].glyph in self.markAttachmentSet,
-                    mask,
-                )
-            )
-
-        if self.current_feature_mask:
-            feature = self.current_feature_mask
-            mask = list(
-                filter(
-                    lambda ix: (feature not in self.items[ix].feature_masks)
-                        or (not self.items[ix].feature_masks[feature]),
-                    mask
-                )
-            )
-        self.mask = mask
+        key = self._mask_key()
+        cached = self._masks.get(key)
+        if cached and cached[0] is self.markFilteringSet and cached[1] is self.markAttachmentSet:
+            if cached[4] is not None:
+                self._refresh_mask(cached)
+            self.mask = cached[3]
+            return
+        test = self._mask_test()
+        self.mask = [ix for ix, item in enumerate(self.items) if test(item)]
+        self._masks[key] = [self.markFilteringSet, self.markAttachmentSet, test, self.mask, None]
+
+    def _mask_test(self):
+        # Returns a function which says whether an item is visible under
+        # the current flags, mark sets and feature.
+        flags = self.flags
+        ignored = set()
+        if flags & 0x2:  # IgnoreBases
+            ignored.add("base")
+        if flags & 0x4:  # IgnoreLigatures
+            ignored.add("ligature")
+        if flags & 0x8:  # IgnoreMarks
+            ignored.add("mark")
+        mark_sets = []
+        if flags & 0x10:  # UseMarkFilteringSet
+            mark_sets.append(set(self.markFilteringSet))
+        if flags & 0xFF00:  # MarkAttachmentType
+            mark_sets.append(set(self.markAttachmentSet))
+        feature = feature_bit(self.current_feature_mask) if self.current_feature_mask else 0
+
+        def test(item):
+            category = item.category[0]
+            if category in ignored:
+                return False
+            if category == "mark":
+                for mark_set in mark_sets:
+                    if item.glyph not in mark_set:
+                        return False
+            if item.feature_masks & feature:
+                return False
+            return True
+
+        return test
+
+    def _patch_masks(self, start, end, count):
+        # Items start to end have been replaced by count new items; bring
+        # the cached masks up to date without recomputing them. If the
+        # number of items has changed, the indexes after them move along,
+        # which is only done straight away for the mask in use; the others
+        # remember where they went stale and are refreshed from there when
+        # they are next selected.
+        delta = count - (end - start)
+        self.base_searches = {}
+        for entry in self._masks.values():
+            mfs, mas, test, mask, stale = entry
+            if stale is not None:
+                entry[4] = min(stale, start)
+                continue
+            if delta and mask is not self.mask:
+                entry[4] = start
+                continue
+            lo = bisect_left(mask, start)
+            hi = bisect_left(mask, end)
+            visible = [ix for ix in range(start, start + count) if test(self.items[ix])]
+            if delta:
+                mask[lo:] = visible + [ix + delta for ix in mask[hi:]]
+            else:
+                mask[lo:hi] = visible
+
+    def _refresh_mask(self, entry):
+        # Nothing before the index where the mask went stale has changed
+        test, mask, stale = entry[2], entry[3], entry[4]
+        items = self.items
+        mask[bisect_left(mask, stale):] = [ix for ix in range(stale, len(items)) if test(items[ix])]
+        entry[4] = None
+
+    def item_changed(self, key):
+        """Updates the masks after the glyph or category of the item at
+        (masked) position ``key`` has been changed in place."""
+        ix = self.mask[key]
+        self._patch_masks(ix, ix + 1, 1)
+        self.touched.append(self.items[ix])
+        if self.glyph_digest is not None:
+            self.glyph_digest.add(self.items[ix].glyph)
+
+    def start_glyph_digest(self):
+        """Starts keeping a set of the glyphs in the buffer, which routines
+        use to skip themselves when they can't match any of them.
+
+        The set only grows as glyphs are replaced through the buffer, which
+        is safe: at worst a routine runs and finds nothing to do. Code which
+        puts new glyphs into ``items`` directly must call this again, or
+        ``stop_glyph_digest``, first."""
+        self.glyph_digest = set(item.glyph for item in self.items)
+
+    def stop_glyph_digest(self):
+        self.glyph_digest = None
 
     def set_feature_mask(self, feature):
         self.current_feature_mask = feature
-        self.recompute_mask()
+        self._select_mask()
 
     def move_item(self, src, dest):
         self.items[dest:dest] = [ self.items.pop(src) ]
+        self.invalidate_masks()
 
     def merge_clusters(self, start, end):
         pass  # XXX
@@ -277,7 +480,9 @@ class Buffer:
                 xcursor = xcursor + position.xAdvance
             elif position and hasattr(info, "position"):
                 position = info.position
-                if hasattr(info, "syllable_index"):
+                if hasattr(info, "cluster"):
+                    cluster = info.cluster
+                elif hasattr(info, "syllable_index"):
                     cluster = info.syllable_index
                 else:
                     cluster = ix
@@ -1,12 +1,6 @@
 def shaper_inputs(self):
     return self.input
 
-def __find_masked_ix(buf, ix):
-    # This probably could be done better...
-    for i in range(len(buf.items)):
-        if buf.mask[i] == ix: return i
-    return -1
-
 def _do_apply(self, buf, ix, namedclasses={}):
     from fontFeatures import RoutineReference
     # Save buffer mask
@@ -25,12 +19,44 @@ def _do_apply(self, buf, ix, namedclasses={}):
             routine = routine.routine
             # Adjust mask and recompute index?
             unmasked_ix = old_unmasked_indexes[i]
-            for rule in routine.rules:
+            for rule in _nested_rules(routine, buf, unmasked_ix, namedclasses):
                 buf.set_mask(rule.flags, routine.markFilteringSet)
-                newix = __find_masked_ix(buf, unmasked_ix)
+                newix = buf.masked_index(unmasked_ix)
+                if newix is None:
+                    continue
                 if rule.would_apply_at_position(buf,newix, namedclasses) and rule._do_apply(buf, newix):
                     break
 
     buf.set_mask(flags, markFilteringSet)
     return len(self.input) - 1
 
+
+def _nested_rules(routine, buf, unmasked_ix, namedclasses):
+    # Yields the rules of a nested routine which could apply to the glyph
+    # at unmasked_ix, in order. Rules which don't stop the search (single
+    # substitutions) may change the glyph, so we look again after each one.
+    from fontFeatures.shaperLib.Routine import _coverage_index, _rule_positions
+
+    rules, index, wildcard, _ = _coverage_index(routine, None, namedclasses)
+    if index is None:
+        yield from rules
+        return
+    if unmasked_ix >= len(buf.items):
+        return
+    item = buf.items[unmasked_ix]
+    glyph = item.glyph
+    candidates = index.get(glyph, wildcard)
+    k = 0
+    while k < len(candidates):
+        rule = candidates[k]
+        k = k + 1
+        yield rule
+        if unmasked_ix >= len(buf.items):
+            return
+        if buf.items[unmasked_ix] is not item or item.glyph != glyph:
+            item = buf.items[unmasked_ix]
+            glyph = item.glyph
+            positions = _rule_positions(routine, rules)
+            tried = positions[rule]
+            candidates = [r for r in index.get(glyph, wildcard) if positions[r] > tried]
+            k = 0
@@ -0,0 +1,69 @@
+class Face:
+    """Lookup tables for the glyphs of a font, as needed by the shaper.
+
+    Finding a glyph ID by searching the font's glyph order, or asking the
+    font for a glyph's width and category, is slow; a Face does each of
+    these once per glyph and remembers the answer. Faces are shared between
+    all buffers using the same font, so get one with ``Face.for_font(font)``
+    rather than making your own. The tables assume that the font's glyphs
+    are not edited while it is being used for shaping.
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self._build_gids()
+
+    @classmethod
+    def for_font(klass, font):
+        face = getattr(font, "_shaping_face", None)
+        if face is None:
+            face = klass(font)
+            font._shaping_face = face
+        return face
+
+    def _build_gids(self):
+        glyphOrder = self.font.glyphOrder
+        self.gids = {}
+        for gid, name in enumerate(glyphOrder):
+            self.gids.setdefault(name, gid)
+        self.advances = [None] * len(glyphOrder)
+        self.categories = [None] * len(glyphOrder)
+        self._unordered = {}
+
+    def gid(self, glyph):
+        """Returns the glyph ID of the named glyph, or -1 if it is not in
+        the font's glyph order."""
+        gid = self.gids.get(glyph)
+        if gid is None:
+            # Glyphs may have been added since we looked
+            if len(self.font.glyphOrder) != len(self.advances):
+                self._build_gids()
+            gid = self.gids.get(glyph, -1)
+        return gid
+
+    def advance(self, glyph):
+        """Returns the advance width of the named glyph."""
+        return self._glyph_attribute(glyph, self.advances, "width")
+
+    def category(self, glyph):
+        """Returns the category of the named glyph, as stored in the font."""
+        return self._glyph_attribute(glyph, self.categories, "category")
+
+    def _glyph_attribute(self, glyph, table, attribute):
+        gid = self.gid(glyph)
+        if gid >= 0:
+            value = table[gid]
+        else:
+            value = self._unordered.get((glyph, attribute))
+        if value is None:
+            try:
+                value = getattr(self.font[glyph], attribute)
+            except Exception as e:
+                value = e
+            if gid >= 0:
+                table[gid] = value
+            else:
+                self._unordered[(glyph, attribute)] = value
+        if isinstance(value, Exception):
+            raise value.with_traceback(None)
+        return value
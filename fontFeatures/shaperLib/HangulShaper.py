@@ -44,9 +44,9 @@ class HangulShaper(BaseShaper):
 
         # Setup masks here too
         for i in self.buffer.items:
-            i.feature_masks["ljmo"] = False
-            i.feature_masks["vjmo"] = False
-            i.feature_masks["tjmo"] = False
+            i.mask_feature("ljmo", False)
+            i.mask_feature("vjmo", False)
+            i.mask_feature("tjmo", False)
         start, end, processed = 0, 0, 0
         count = len(self.buffer.items)
         for i in range(count):
@@ -92,10 +92,10 @@ class HangulShaper(BaseShaper):
                             end = start + 1
                             continue
                     # Didn't compose
-                    self.buffer.items[i].feature_masks["ljmo"] = True
-                    self.buffer.items[i+1].feature_masks["vjmo"] = True
+                    self.buffer.items[i].mask_feature("ljmo")
+                    self.buffer.items[i+1].mask_feature("vjmo")
                     if t:
-                        self.buffer.items[i+2].feature_masks["tjmo"] = True
+                        self.buffer.items[i+2].mask_feature("tjmo")
                         end = start + 3
                     else:
                         end = start + 2
@@ -129,10 +129,10 @@ class HangulShaper(BaseShaper):
                             i = i + 1
                             s_len = s_len + 1
                         end = start + s_len
-                        self.buffer.items[start+1].feature_masks["ljmo"] = True
-                        self.buffer.items[start+2].feature_masks["vjmo"] = True
+                        self.buffer.items[start+1].mask_feature("ljmo")
+                        self.buffer.items[start+2].mask_feature("vjmo")
                         if start + 3 < end:
-                            self.buffer.items[start+3].feature_masks["tjmo"] = True
+                            self.buffer.items[start+3].mask_feature("tjmo")
                         # merge out clusters
                         continue
                     elif not tindex and i + 1 < count and isT(cp(i+1)):
@@ -1,4 +1,4 @@
-from youseedee import ucd_data
+from fontFeatures.shaperLib.UnicodeProperties import unicode_property
 from .BaseShaper import BaseShaper
 import re
 from fontFeatures.shaperLib.Buffer import BufferItem
@@ -22,6 +22,14 @@ class IndicShaper(SyllabicShaper):
         shaper.disable_feature("liga")
 
     def consonant_position_from_face(self, consonant):
+        # This only depends on the font and the script, so remember it for
+        # as long as the Shaper lives
+        key = (self.buffer.script, consonant)
+        if key not in self.plan.consonant_positions:
+            self.plan.consonant_positions[key] = self._consonant_position_from_face(consonant)
+        return self.plan.consonant_positions[key]
+
+    def _consonant_position_from_face(self, consonant):
         virama = self.config["virama"]
         consonant_item = BufferItem.new_unicode(consonant)
         virama_item = BufferItem.new_unicode(virama)
@@ -228,13 +236,13 @@ class IndicShaper(SyllabicShaper):
         for i in range(start, end):
             if pos(i) != IndicPosition.RA_TO_BECOME_REPH:
                 rphf_mask = True
-            self.buffer.items[i].feature_masks["rphf"] = rphf_mask
-            self.buffer.items[i].feature_masks["half"] = i > base
+            self.buffer.items[i].mask_feature("rphf", rphf_mask)
+            self.buffer.items[i].mask_feature("half", i > base)
             if not self.config["old_spec"] and self.config["blwf_mode"] == "pre_and_post":
-                self.buffer.items[i].feature_masks["blwf"] = i > base
-            self.buffer.items[i].feature_masks["blwf"] = i < base
-            self.buffer.items[i].feature_masks["abvf"] = i < base
-            self.buffer.items[i].feature_masks["pstf"] = i < base
+                self.buffer.items[i].mask_feature("blwf", i > base)
+            self.buffer.items[i].mask_feature("blwf", i < base)
+            self.buffer.items[i].mask_feature("abvf", i < base)
+            self.buffer.items[i].mask_feature("pstf", i < base)
 
         # We are not supporting old spec eyelash ra
 
@@ -242,14 +250,18 @@ class IndicShaper(SyllabicShaper):
         pref_len = 2
         i = base + 1
         for j in range(0,i):
-            self.buffer.items[j].feature_masks["pref"] = True
+            self.buffer.items[j].mask_feature("pref")
+            self.buffer.items[j].pref_pair = False
         while i < end-pref_len:
             if self.would_substitute("pref", [self.buffer.items[i], self.buffer.items[i+1]]):
-                self.buffer.items[i].feature_masks["pref"] = False
-                self.buffer.items[i+1].feature_masks["pref"] = False
+                for item in self.buffer.items[i:i+2]:
+                    item.mask_feature("pref", False)
+                    # Final reordering looks for these
+                    item.pref_pair = True
                 i = i + 2
             else:
-                self.buffer.items[i].feature_masks["pref"] = True
+                self.buffer.items[i].mask_feature("pref")
+                self.buffer.items[i].pref_pair = False
                 i = i + 1
 
         # ZWJ/ZWNJ
@@ -260,7 +272,7 @@ class IndicShaper(SyllabicShaper):
                 while True:
                     j = j - 1
                     if non_joiner:
-                        self.buffer.items[j].feature_masks["half"] = True
+                        self.buffer.items[j].mask_feature("half")
                     if not (j > start and not is_consonant(j)):
                         break
 
@@ -298,14 +310,14 @@ class IndicShaper(SyllabicShaper):
                     self.buffer.items[i].syllabic_category = "H"
                     self.buffer.items[i].ligated = False
                     self.buffer.items[i].multiplied = False
-        try_pref = any(["pref" in item.feature_masks and item.feature_masks["pref"] == False for item in self.buffer.items])
+        try_pref = any([getattr(item, "pref_pair", False) for item in self.buffer.items])
         base = start
         while base < end:
             if pos(base) >= IndicPosition.BASE_C:
                 if try_pref and base + 1 < end:
                     for i in range(base+1, end):
                         item = self.buffer.items[i]
-                        if not item.feature_masks.get("pref",True):
+                        if getattr(item, "pref_pair", False):
                             if not (item.substituted and (item.ligated and not item.multiplied)):
                                 base = i
                                 while base < end and is_halant(base):
@@ -345,10 +357,10 @@ class IndicShaper(SyllabicShaper):
             # XXX
 
         for i in range(start,end):
-            self.buffer.items[i].feature_masks["init"] = True
+            self.buffer.items[i].mask_feature("init")
         if pos(start) == IndicPosition.PRE_M:
-            if start == 0 or ucd_data(self.buffer.font.codepointForGlyph(self.buffer.items[start-1].glyph))["General_Category"] not in ["Cf", "Cn", "Co", "Cs", "Ll", "Lm", "Lo", "Lt", "Lu", "Mc", "Me", "Mn"]:
-                self.buffer.items[start].feature_masks["init"] = False
+            if start == 0 or unicode_property(self.buffer.font.codepointForGlyph(self.buffer.items[start-1].glyph), "General_Category") not in ["Cf", "Cn", "Co", "Cs", "Ll", "Lm", "Lo", "Lt", "Lu", "Mc", "Me", "Mn"]:
+                self.buffer.items[start].mask_feature("init", False)
 
 
     def normalize_unicode_buffer(self):
@@ -378,7 +390,7 @@ class IndicShaper(SyllabicShaper):
             b = newunicodes[ix+1]
             s = chr(a) + chr(b)
             composed = unicodedata.normalize("NFC", s)
-            if ucd_data(a)["General_Category"][0] == "M":
+            if unicode_property(a, "General_Category")[0] == "M":
                 newstring = newstring + chr(a)
                 ix = ix + 1
                 continue
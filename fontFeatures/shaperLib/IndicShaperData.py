@@ -1,7 +1,7 @@
 from collections import OrderedDict
 from enum import IntEnum
 import re
-from youseedee import ucd_data
+from fontFeatures.shaperLib.UnicodeProperties import unicode_property
 
 
 script_config = {
@@ -194,7 +194,7 @@ matra_pos_bottom = {
 }
 
 def set_matra_position(item):
-    script = ucd_data(item.codepoint)["Script"]
+    script = unicode_property(item.codepoint, "Script")
     u = item.codepoint
     if item.syllabic_position == IndicPosition.PRE_C:
         selector = matra_pos_left
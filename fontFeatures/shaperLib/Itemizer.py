@@ -0,0 +1,38 @@
+"""Splitting text into runs of a single script and direction."""
+
+from fontFeatures.shaperLib.UnicodeProperties import unicode_property, script_extensions
+
+_neutral_scripts = ["Common", "Inherited", "Unknown"]
+
+
+def itemize(text, direction=None):
+    """Splits text into runs of a single script, returning a list of
+    ``(start, end, script, direction)`` tuples in logical order, where
+    ``start`` and ``end`` are offsets into the text.
+
+    Characters without a script of their own (spaces, punctuation,
+    combining marks) stay in the run they appear in, or join the first run
+    if they begin the text, as do characters whose script extensions
+    include the script of the run. Each run has the direction of its
+    script unless ``direction`` is given. This is not the Unicode
+    bidirectional algorithm: runs are only split where the script changes.
+    """
+    from fontFeatures.shaperLib.Shaper import _script_direction
+
+    spans = []
+    start, script = 0, None
+    for ix, char in enumerate(text):
+        codepoint = ord(char)
+        this = unicode_property(codepoint, "Script")
+        if this in _neutral_scripts:
+            continue
+        if script is None:
+            script = this
+            continue
+        if this == script or script in script_extensions(codepoint):
+            continue
+        spans.append((start, ix, script))
+        start, script = ix, this
+    if text:
+        spans.append((start, len(text), script))
+    return [(start, end, script, direction or _script_direction(script)) for start, end, script in spans]
@@ -1,7 +1,7 @@
 from .IndicShaperData import IndicPosition, make_syllable_machine, syllabic_category_map
 from .SyllabicShaper import SyllabicShaper
 import unicodedata
-from youseedee import ucd_data
+from fontFeatures.shaperLib.UnicodeProperties import unicode_property
 from collections import OrderedDict
 
 
@@ -78,11 +78,11 @@ class KhmerShaper(SyllabicShaper):
         def mask_disallow(places, *feats):
             for p in places:
                 for f in feats:
-                    self.buffer.items[p].feature_masks[f] = True
+                    self.buffer.items[p].mask_feature(f)
         def mask_allow(places, *feats):
             for p in places:
                 for f in feats:
-                    self.buffer.items[p].feature_masks[f] = False
+                    self.buffer.items[p].mask_feature(f, False)
 
         mask_allow(range(start+1, end), "blwf", "advf", "pstf")
         mask_disallow(range(start, end), "cfar")
@@ -131,7 +131,7 @@ class KhmerShaper(SyllabicShaper):
             b = newunicodes[ix+1]
             s = chr(a) + chr(b)
             composed = unicodedata.normalize("NFC", s)
-            if ucd_data(a)["General_Category"][0] == "M":
+            if unicode_property(a, "General_Category")[0] == "M":
                 newstring = newstring + chr(a)
                 ix = ix + 1
                 continue
@@ -1,22 +1,283 @@
 import logging
+from itertools import chain
+from fontFeatures.shaperLib.Rule import _expand_slot, _referenced_classes, _classes_current
+
+logger = logging.getLogger("fontFeatures.shaperLib")
 
 __all__ = ["apply_to_buffer"]
 
 
+def _first_slot(rule):
+    # The slot of glyphs which may appear at the position a rule is tested
+    # at, or None if the rule needs to be tried everywhere.
+    from fontFeatures import Attachment
+
+    if isinstance(rule, Attachment):
+        if rule.is_cursive:
+            return None
+        return rule.marks.keys()
+    coverage = rule.shaper_inputs()
+    if not coverage:
+        return []
+    return coverage[0]
+
+
+def _build_index(rules, namedclasses={}):
+    index = {}
+    wildcard = []
+    for r in rules:
+        first = _first_slot(r)
+        if first is None:
+            wildcard.append(r)
+            for candidates in index.values():
+                candidates.append(r)
+            continue
+        for g in set(_expand_slot(first, namedclasses)):
+            if g not in index:
+                index[g] = list(wildcard)
+            index[g].append(r)
+    return index, wildcard
+
+
+def _context_slots(rule):
+    # The slots of glyphs which must come before the first (nearest first)
+    # and after it for the rule to apply
+    from fontFeatures import Attachment
+
+    if isinstance(rule, Attachment):
+        return [], []
+    before = list(reversed(getattr(rule, "precontext", None) or []))
+    after = list(rule.shaper_inputs()[1:]) + list(getattr(rule, "postcontext", None) or [])
+    return before, after
+
+
+def _build_levels(slot_lists, namedclasses={}):
+    # For each distance from the first glyph, a mapping of glyph name to
+    # the rules which accept that glyph there, and the rules which don't
+    # look that far; rules are bits of an integer, in rule order.
+    levels = []
+    for n, slots in enumerate(slot_lists):
+        for d, slot in enumerate(slots):
+            if d == len(levels):
+                levels.append({})
+            for g in _expand_slot(slot, namedclasses):
+                levels[d][g] = levels[d].get(g, 0) | 1 << n
+    done = [
+        sum(1 << n for n, slots in enumerate(slot_lists) if len(slots) <= d)
+        for d in range(len(levels))
+    ]
+    return list(zip(levels, done))
+
+
+def _build_matcher(rules, namedclasses={}):
+    # Tables of the glyphs each rule needs around the first glyph, in its
+    # input, precontext and postcontext. Walking out from a position through
+    # these finds the rules which match there with one lookup per glyph,
+    # rather than testing each of them slot by slot; in routines of many
+    # ligatures or contextual rules with a common start, most candidates
+    # are ruled out this way.
+    contexts = [_context_slots(r) for r in rules]
+    if not any(before or after for before, after in contexts):
+        return None
+    bits = {r: 1 << n for n, r in enumerate(rules)}
+    backward = _build_levels([before for before, after in contexts], namedclasses)
+    forward = _build_levels([after for before, after in contexts], namedclasses)
+    return backward, forward, bits
+
+
+def _matching_rules(matcher, candidates, buf, i):
+    backward, forward, bits = matcher
+    allowed = -1
+    for d, (level, done) in enumerate(forward, start=1):
+        if i + d >= len(buf):
+            allowed &= done
+            break
+        allowed &= level.get(buf[i + d].glyph, 0) | done
+        if not allowed & ~done:
+            break
+    for d, (level, done) in enumerate(backward, start=1):
+        if not allowed & ~done:
+            break
+        if i - d < 0:
+            allowed &= done
+            break
+        allowed &= level.get(buf[i - d].glyph, 0) | done
+    return [r for r in candidates if allowed & bits[r]]
+
+
+def _coverage_index(self, stage=None, namedclasses={}):
+    """Returns the rules of this routine for the given stage, a mapping of
+    glyph name to the rules which could apply at that glyph (in rule order),
+    the list of rules to try for glyphs not in the mapping, and tables for
+    ``_matching_rules`` to narrow down the rules by the glyphs around the
+    first (or None if no rule looks beyond the first glyph).
+
+    If the rules have differing flags, the glyph at each position depends on
+    the rule being tested, so no mapping can be made and None is returned in
+    place of the mapping and tables.
+
+    The index is cached on the routine and rebuilt if rules are added or the
+    named classes used by the rules are redefined."""
+    if not hasattr(self, "_coverage_indexes"):
+        self._coverage_indexes = {}
+    cached = self._coverage_indexes.get(stage)
+    if cached:
+        all_rules, rule_count, classes, referenced, compiled = cached
+        if all_rules is self.rules and rule_count == len(all_rules) and classes is namedclasses \
+            and _classes_current(referenced, namedclasses):
+            return compiled
+
+    rules = [r for r in self.rules if not stage or r.stage == stage]
+    if len(set(r.flags for r in rules)) > 1:
+        index, wildcard, matcher = None, None, None
+        referenced = []
+    else:
+        index, wildcard = _build_index(rules, namedclasses)
+        matcher = _build_matcher(rules, namedclasses)
+        slots = chain(filter(None, map(_first_slot, rules)), *chain(*map(_context_slots, rules)))
+        referenced = _referenced_classes(slots, namedclasses)
+    compiled = (rules, index, wildcard, matcher)
+    self._coverage_indexes[stage] = (self.rules, len(self.rules), namedclasses, referenced, compiled)
+    return compiled
+
+
+def _rule_positions(self, rules):
+    # The position of each rule among the rules of a coverage index, kept
+    # as long as the index they came from
+    cached = getattr(self, "_rule_positions_cache", None)
+    if cached and cached[0] is rules:
+        return cached[1]
+    positions = {}
+    for n, r in enumerate(rules):
+        positions.setdefault(r, n)
+    self._rule_positions_cache = (rules, positions)
+    return positions
+
+
+_unknown = object()
+
+
+def _build_pair_table(rules, namedclasses={}):
+    # For a routine of pair positioning rules and nothing else: each glyph
+    # which can start (or end) a pair is given a class, by the set of rules
+    # it appears in on that side, and the rule for each pair of classes is
+    # looked up in a matrix. The matrix is filled in as pairs are met, with
+    # the first rule which has both glyphs, so a pair costs two class
+    # lookups and a matrix lookup however many rules there are.
+    from fontFeatures import Positioning
+
+    for r in rules:
+        if not isinstance(r, Positioning) or len(r.glyphs) != 2 or r.precontext or r.postcontext:
+            return None
+    sides = []
+    for side in range(2):
+        signatures = {}
+        for n, r in enumerate(rules):
+            for g in _expand_slot(r.glyphs[side], namedclasses):
+                signatures[g] = signatures.get(g, 0) | 1 << n
+        classes = {}
+        for g, signature in signatures.items():
+            signatures[g] = classes.setdefault(signature, len(classes))
+        sides.append((signatures, list(classes)))
+    (left, left_signatures), (right, right_signatures) = sides
+    matrix = {}
+    return left, right, left_signatures, right_signatures, matrix, rules
+
+
+def _pair_table(self, compiled, stage=None, namedclasses={}):
+    # The pair table is built from, and kept as long as, the coverage index
+    if not hasattr(self, "_pair_tables"):
+        self._pair_tables = {}
+    cached = self._pair_tables.get(stage)
+    if cached and cached[0] is compiled:
+        return cached[1]
+    table = None
+    if compiled[1] is not None:
+        table = _build_pair_table(compiled[0], namedclasses)
+    self._pair_tables[stage] = (compiled, table)
+    return table
+
+
+def _apply_pairs(self, buf, table, namedclasses={}):
+    # Positioning doesn't change the items, so the mask holds throughout
+    left, right, left_signatures, right_signatures, matrix, rules = table
+    width = len(right_signatures)
+    items, mask = buf.items, buf.mask
+    i = 0
+    while i < len(mask) - 1:
+        lc = left.get(items[mask[i]].glyph)
+        rc = right.get(items[mask[i + 1]].glyph)
+        if lc is not None and rc is not None:
+            cell = lc * width + rc
+            r = matrix.get(cell, _unknown)
+            if r is _unknown:
+                both = left_signatures[lc] & right_signatures[rc]
+                r = matrix[cell] = rules[(both & -both).bit_length() - 1] if both else None
+            if r is not None:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Applying rule %s at position %i\n", r.asFea(), i)
+                delta = r._do_apply(buf, i, namedclasses=namedclasses)
+                if delta:
+                    i = i + delta
+        i = i + 1
+
+
 def apply_to_buffer(self, buf, stage=None, feature=None, namedclasses={}):
+    if buf.glyph_digest is not None:
+        rules, index, wildcard, matcher = _coverage_index(self, stage, namedclasses)
+        if index is not None and not wildcard and index.keys().isdisjoint(buf.glyph_digest):
+            return
     buf.set_mask(self.flags, self.markFilteringSet, self.markAttachmentSet)
     if feature:
         buf.set_feature_mask(feature)
+    compiled = _coverage_index(self, stage, namedclasses)
+    rules, index, wildcard, matcher = compiled
+    if not rules:
+        return
+    if index is None:
+        return _apply_all_rules(self, buf, rules, namedclasses)
+    flags = rules[0].flags
+    pairs = _pair_table(self, compiled, stage, namedclasses)
+    if pairs:
+        # As in the loop below: nothing is done if the routine's flags hide
+        # every glyph, and otherwise glyphs are masked by the rules' flags
+        if not len(buf):
+            return
+        buf.set_mask(flags, self.markFilteringSet, self.markAttachmentSet)
+        if feature:
+            buf.set_feature_mask(feature)
+        return _apply_pairs(self, buf, pairs, namedclasses)
+
+    i = 0
+    while i < len(buf): # (which may change!)
+        buf.set_mask(flags, self.markFilteringSet, self.markAttachmentSet)
+        if i >= len(buf):
+            break
+        candidates = index.get(buf[i].glyph, wildcard)
+        if matcher and len(candidates) > 1:
+            candidates = _matching_rules(matcher, candidates, buf, i)
+        for r in candidates:
+            if r.would_apply_at_position(buf, i,namedclasses=namedclasses):
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Applying rule %s at position %i\n", r.asFea(), i)
+                delta = r._do_apply(buf, i, namedclasses=namedclasses)
+                buf.update_touched()
+                if delta:
+                    i = i + delta
+                break
+        i = i + 1
+
+
+def _apply_all_rules(self, buf, rules, namedclasses={}):
     i = 0
     while i < len(buf): # (which may change!)
-        for r in self.rules:
-            if stage and r.stage != stage:
-                continue
+        for r in rules:
             buf.set_mask(r.flags, self.markFilteringSet, self.markAttachmentSet)
             if r.would_apply_at_position(buf, i,namedclasses=namedclasses):
-                logging.getLogger("fontFeatures.shaperLib").debug("Applying rule %s at position %i\n" % (r.asFea(), i))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Applying rule %s at position %i\n", r.asFea(), i)
                 delta = r._do_apply(buf, i, namedclasses=namedclasses)
-                buf.update()
+                buf.update_touched()
                 if delta:
                     i = i + delta
                 break
@@ -1,64 +1,123 @@
 import logging
+from itertools import chain
+from sys import intern
 
-__all__ = ["apply_to_buffer", "would_apply_at_position", "pre_post_context_matches", "_expand_slot"]
+logger = logging.getLogger("fontFeatures.shaperLib")
+
+__all__ = ["apply_to_buffer", "would_apply_at_position", "pre_post_context_matches", "compiled_slots", "_expand_slot"]
 
 
 def i2s(buffer_items):
     return "|".join([x.glyph for x in buffer_items])
 
 def _expand_slot(slot, namedclasses={}):
+    # Glyph names are interned, so that the many rules and tables mentioning
+    # a glyph share one string, and comparing it with the (also interned)
+    # glyph of a buffer item is an identity check.
     expanded = []
     for g in slot:
         if g.startswith("@"):
-            expanded.extend(namedclasses.get(g[1:], ""))
+            expanded.extend(map(intern, namedclasses.get(g[1:], "")))
         else:
-            expanded.append(g)
+            expanded.append(intern(g))
     return expanded
 
-def glyphs_match(buffer_glyphs, routine_glyphs, namedclasses={}):
-    if len(buffer_glyphs) != len(routine_glyphs):
+def _referenced_classes(slots, namedclasses={}):
+    # Remember the current definition of each class used in the slots, so
+    # that cached expansions can be checked against redefinitions
+    referenced = {}
+    for slot in slots:
+        for g in slot:
+            if g.startswith("@"):
+                referenced[g[1:]] = namedclasses.get(g[1:])
+    return list(referenced.items())
+
+def _classes_current(referenced, namedclasses={}):
+    return all(namedclasses.get(name) is value for name, value in referenced)
+
+def _slot_lists(self):
+    return (getattr(self, "precontext", ()), self.shaper_inputs(), getattr(self, "postcontext", ()))
+
+def _compiled_slots_current(self, cached, namedclasses):
+    lists, slots, classes, referenced, _ = cached
+    if classes is not namedclasses:
+        return False
+    current = _slot_lists(self)
+    if any(a is not b for a, b in zip(lists, current)):
+        return False
+    if len(slots) != sum(len(l) for l in current):
+        return False
+    if any(a is not b for a, b in zip(slots, chain(*current))):
+        return False
+    return _classes_current(referenced, namedclasses)
+
+def compiled_slots(self, namedclasses={}):
+    """Returns the precontext, input and postcontext of this rule as tuples
+    of frozensets of glyph names, with named classes expanded.
+
+    The result is cached on the rule, and recomputed if any of the rule's
+    slots are replaced or the named classes it uses are redefined."""
+    cached = getattr(self, "_compiled_slots", None)
+    if cached and _compiled_slots_current(self, cached, namedclasses):
+        return cached[-1]
+    lists = _slot_lists(self)
+    referenced = _referenced_classes(chain(*lists), namedclasses)
+    compiled = tuple(
+        tuple(frozenset(_expand_slot(slot, namedclasses)) for slot in l)
+        for l in lists
+    )
+    self._compiled_slots = (lists, tuple(chain(*lists)), namedclasses, referenced, compiled)
+    return compiled
+
+def glyphs_match(buffer_glyphs, slots):
+    if len(buffer_glyphs) != len(slots):
         return False
-    for a, b in zip(buffer_glyphs, routine_glyphs):
-        if a.glyph not in _expand_slot(b, namedclasses):
+    for a, b in zip(buffer_glyphs, slots):
+        if a.glyph not in b:
             return False
     return True
 
 def pre_post_context_matches(self, buf, ix, namedclasses={}):
-    if hasattr(self, "precontext") and self.precontext:
-        if ix < len(self.precontext):
-            logging.getLogger("fontFeatures.shaperLib").debug(" - No, not enough precontext")
+    precontext, coverage, postcontext = compiled_slots(self, namedclasses)
+    if precontext:
+        if ix < len(precontext):
+            logger.debug(" - No, not enough precontext")
             return False
-        precontext = buf[ix - len(self.precontext) : ix]
-        if not glyphs_match(precontext, self.precontext, namedclasses):
-            logging.getLogger("fontFeatures.shaperLib").debug(" - No, precontext doesn't match %s != %s" % (i2s(precontext), self.precontext))
+        buffer_precontext = buf[ix - len(precontext) : ix]
+        if not glyphs_match(buffer_precontext, precontext):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(" - No, precontext doesn't match %s != %s", i2s(buffer_precontext), self.precontext)
             return False
-    if hasattr(self, "postcontext") and self.postcontext:
-        coverage = self.shaper_inputs()
+    if postcontext:
         coverage_l = len(coverage)
         end_of_coverage = ix + coverage_l
-        if end_of_coverage + len(self.postcontext) > len(buf):
-            logging.getLogger("fontFeatures.shaperLib").debug(" - No, not enough postcontext")
+        if end_of_coverage + len(postcontext) > len(buf):
+            logger.debug(" - No, not enough postcontext")
             return False
-        postcontext = buf[end_of_coverage : end_of_coverage + len(self.postcontext)]
-        if not glyphs_match(postcontext, self.postcontext, namedclasses):
-            logging.getLogger("fontFeatures.shaperLib").debug(" - No, postcontext doesn't match %s != %s" % (i2s(postcontext), self.postcontext))
+        buffer_postcontext = buf[end_of_coverage : end_of_coverage + len(postcontext)]
+        if not glyphs_match(buffer_postcontext, postcontext):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(" - No, postcontext doesn't match %s != %s", i2s(buffer_postcontext), self.postcontext)
             return False
     return True
 
 def would_apply_at_position(self, buf, ix, namedclasses={}):
-    logging.getLogger("fontFeatures.shaperLib").debug("Testing if %s would apply at position %i" % (self.asFea(), ix))
-    coverage = self.shaper_inputs()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Testing if %s would apply at position %i", self.asFea(), ix)
+    coverage = compiled_slots(self, namedclasses)[1]
     coverage_l = len(coverage)
     if coverage_l < 1: return False
     buffer_glyphs = buf[ix : ix + coverage_l]
 
-    if not glyphs_match(buffer_glyphs, coverage, namedclasses):
-        logging.getLogger("fontFeatures.shaperLib").debug(" - No! %s != %s" % (i2s(buffer_glyphs), coverage))
+    if not glyphs_match(buffer_glyphs, coverage):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(" - No! %s != %s", i2s(buffer_glyphs), self.shaper_inputs())
         return False
 
     if not pre_post_context_matches(self, buf, ix, namedclasses):
         return False
 
-    logging.getLogger("fontFeatures.shaperLib").debug(" - Yes! %s == %s" % (i2s(buffer_glyphs), coverage))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(" - Yes! %s == %s", i2s(buffer_glyphs), self.shaper_inputs())
     return True
 
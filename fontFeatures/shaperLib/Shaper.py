@@ -1,3 +1,4 @@
+from babelfont import Babelfont
 from babelfont.font import Font
 from fontFeatures import FontFeatures
 import unicodedata
@@ -9,12 +10,80 @@ from .MyanmarShaper import MyanmarShaper
 from .HangulShaper import HangulShaper
 from .KhmerShaper import KhmerShaper
 from .USEShaper import USEShaper
+from .Itemizer import itemize
+from collections import OrderedDict
+from copy import copy
 import logging
+import multiprocessing
 import re
 
+logger = logging.getLogger("fontFeatures.shaperLib")
+
+
+class ShapePlan:
+    """The decisions the shaper makes before looking at a buffer's contents:
+    which complex shaper to use, and the features (with the routines which
+    implement them) and pauses which make up each stage of shaping.
+
+    These depend only on the buffer's script, language and direction and on
+    the user features, so the Shaper caches plans and reuses them for
+    buffers which share these properties. ``stages`` holds a tuple of
+    feature tags or a pause function (called with the complex shaper and
+    the stage name) for each stage, and ``lookups`` holds the
+    ``(routine, feature)`` pairs to apply for each feature stage."""
+
+    def __init__(self, shaper_class, stages, lookups):
+        self.shaper_class = shaper_class
+        self.stages = tuple(stages)
+        self.lookups = tuple(lookups)
+
+
+class WordCache:
+    """A bounded cache of shaping results, keyed by the buffer's input
+    along with everything which goes into its shape plan. When text is
+    shaped a word at a time, most words are found here rather than
+    shaped again.
+
+    ``hits``, ``misses`` and ``evictions`` count what the cache has done."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fetch(self, key, buf):
+        """Fills the buffer with the cached result for the key, returning
+        False if there isn't one."""
+        items = self.entries.get(key)
+        if items is None:
+            self.misses += 1
+            return False
+        self.entries.move_to_end(key)
+        self.hits += 1
+        buf.items = [_copy_item(x) for x in items]
+        buf.clear_mask()
+        return True
+
+    def store(self, key, buf):
+        self.entries[key] = [_copy_item(x) for x in buf.items]
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+def _copy_item(item):
+    item = copy(item)
+    if hasattr(item, "position"):
+        item.position = copy(item.position)
+    return item
+
 
 class Shaper:
-    def __init__(self, ff, font, message_function=None):
+    plan_cache_size = 64
+
+    def __init__(self, ff, font, message_function=None, word_cache_size=0):
         assert isinstance(ff, FontFeatures)
         assert isinstance(font, Font)
         self.fontfeatures = ff
@@ -23,26 +92,181 @@ class Shaper:
             self.msg = message_function
         else:
             self.msg = self.default_message_function
+        self.plans = OrderedDict()
+        # Consonant positions probed from the font by the Indic shaper
+        self.consonant_positions = {}
+        if word_cache_size:
+            self.word_cache = WordCache(word_cache_size)
+        else:
+            self.word_cache = None
 
     def execute(self, buf, features=[]):
-        # Choose complex shaper
-        self.complexshaper = self.categorize(buf)(self, self.babelfont, buf, features)
-        self.msg("Using %s" % type(self.complexshaper).__name__)
-        self.stages = [[]]
         if isinstance(features, str):
             self.user_features = self.parse_user_feature_string(features)
         else:
             self.user_features = features
-        self.collect_features(buf)
+        key = (
+            buf.script,
+            buf.language,
+            buf.direction,
+            tuple((f["tag"], f["value"]) for f in self.user_features),
+        )
+        if self.word_cache:
+            word_key = (tuple((x.codepoint, x.glyph) for x in buf.items), key)
+            if self.word_cache.fetch(word_key, buf):
+                self.msg("Found in word cache")
+                return buf
+        self.shape_plan = self.plans.get(key)
+        if self.shape_plan:
+            self.plans.move_to_end(key)
+            self.complexshaper = self.shape_plan.shaper_class(self, self.babelfont, buf, features)
+            self.msg("Using %s" % type(self.complexshaper).__name__)
+        else:
+            # Choose complex shaper
+            self.complexshaper = self.categorize(buf)(self, self.babelfont, buf, features)
+            self.msg("Using %s" % type(self.complexshaper).__name__)
+            self.shape_plan = self.make_plan(buf)
+            self.plans[key] = self.shape_plan
+            if len(self.plans) > self.plan_cache_size:
+                self.plans.popitem(last=False)
         self.complexshaper.shape()
+        if self.word_cache:
+            self.word_cache.store(word_key, buf)
         return buf
 
+    def shape_runs(self, text, features=[], language=None):
+        """Splits a string into runs of a single script (see ``itemize``)
+        and shapes each run in a buffer of its own. Returns a list of
+        ``(start, buffer)`` pairs in logical order, where ``start`` is the
+        offset of the run in the string."""
+        buffers = []
+        for start, end, script, direction in itemize(text):
+            buf = Buffer.Buffer(
+                self.babelfont,
+                unicodes=text[start:end],
+                script=script,
+                direction=direction,
+                language=language,
+            )
+            self.execute(buf, features=features)
+            buffers.append((start, buf))
+        return buffers
+
+    def shape_text(self, text, features=[], serialize_options={}):
+        """Shapes a string and returns the serialized result, in visual
+        order as ff-shape prints it."""
+        buffers = self.shape_runs(text, features)
+        # The first run sets the direction of the whole line
+        if buffers and buffers[0][1].direction == "RTL":
+            buffers.reverse()
+        line = Buffer.Buffer(self.babelfont)
+        for start, buf in buffers:
+            # Clusters are counted from the start of each run, so move them
+            # along to the run's place in the text
+            for ix, item in enumerate(buf.items):
+                if hasattr(item, "syllable_index"):
+                    item.syllable_index = start + item.syllable_index
+                else:
+                    item.cluster = start + ix
+            if buf.direction == "RTL":
+                line.items.extend(reversed(buf.items))
+            else:
+                line.items.extend(buf.items)
+        return line.serialize(**serialize_options)
+
+    def shape_stream(self, chunks, features=[], serialize_options={}, serialize=True):
+        """Shapes text as it is read, yielding the result for each line as
+        soon as the line is complete.
+
+        ``chunks`` may be any iterable of strings, such as an open file;
+        lines may be split between chunks. Only the line being shaped is
+        kept, so texts of any length can be shaped in little memory. Each
+        line is serialized as ``shape_text`` would, or if ``serialize`` is
+        False, the runs and their buffers are yielded (see ``shape_runs``)."""
+        def shape(line):
+            if serialize:
+                return self.shape_text(line, features, serialize_options)
+            return self.shape_runs(line, features)
+
+        pending = ""
+        for chunk in chunks:
+            lines = (pending + chunk).splitlines(True)
+            pending = ""
+            # The last line may continue in the next chunk (even if it
+            # ends in "\r", as the "\n" may follow)
+            if lines and (lines[-1].endswith("\r") or len(lines[-1].splitlines()[0]) == len(lines[-1])):
+                pending = lines.pop()
+            for line in lines:
+                yield shape(line.splitlines()[0])
+        if pending:
+            yield shape(pending.splitlines()[0])
+
+    def shape_many(self, texts, features=[], serialize_options={}, workers=None, fontfile=None):
+        """Shapes each of a sequence of strings, yielding the serialized
+        results in the same order.
+
+        If ``workers`` is greater than one, the strings are shaped in a pool
+        of that many processes. Each worker is set up once, with its own
+        Shaper, and keeps its shape plans between strings. Fonts cannot be
+        sent to other processes, so in this case the workers load the font
+        from ``fontfile``."""
+        if not workers or workers < 2:
+            return (self.shape_text(text, features, serialize_options) for text in texts)
+        if not fontfile:
+            raise ValueError("A font file is needed to shape in multiple processes")
+        return self._shape_in_pool(texts, features, serialize_options, workers, fontfile)
+
+    def _shape_in_pool(self, texts, features, serialize_options, workers, fontfile):
+        with multiprocessing.Pool(
+            workers,
+            initializer=_start_worker,
+            initargs=(
+                self.fontfeatures,
+                fontfile,
+                features,
+                serialize_options,
+                self.word_cache.size if self.word_cache else 0,
+            ),
+        ) as pool:
+            yield from pool.imap(_shape_in_worker, texts, chunksize=64)
+
+    def make_plan(self, buf):
+        """Works out the stages of shaping for this buffer using the current
+        complex shaper, and returns them as a ShapePlan."""
+        self.stages = [[]]
+        self.collect_features(buf)
+        self.fontfeatures.resolveAllRoutines()
+        self.fontfeatures.hoist_languages()
+        stages, lookups = [], []
+        for stage in self.stages:
+            if isinstance(stage, list):
+                stages.append(tuple(stage))
+                lookups.append(tuple(self.complexshaper.lookups_for_features(stage)))
+            else:
+                # Pauses are methods of this complex shaper, but the plan
+                # will be used by others
+                if getattr(stage, "__self__", None) is self.complexshaper:
+                    stages.append(stage.__func__)
+                else:
+                    stages.append(lambda shaper, current_stage, pause=stage: pause(current_stage))
+                lookups.append(None)
+        return ShapePlan(type(self.complexshaper), stages, lookups)
+
+    def tracing(self):
+        """Returns True if messages sent to ``msg`` will be seen by anyone.
+        Callers can check this before building expensive messages."""
+        if self.msg != self.default_message_function:
+            return True
+        return logger.isEnabledFor(logging.INFO)
+
     def default_message_function(self, msg, buffer=None, serialize_options=None):
+        if not logger.isEnabledFor(logging.INFO):
+            return
         ser = ""
         if buffer:
             ser = buffer.serialize(additional=serialize_options)
             msg = msg + " : " + ser
-        logging.getLogger("fontFeatures.shaperLib").info(msg)
+        logger.info(msg)
 
     def parse_user_feature_string(self, features):
         features = features.split(",")
@@ -220,6 +444,20 @@ class Shaper:
             return USEShaper
         return BaseShaper
 
+_worker = None
+
+
+def _start_worker(ff, fontfile, features, serialize_options, word_cache_size):
+    global _worker
+    shaper = Shaper(ff, Babelfont.load(fontfile), word_cache_size=word_cache_size)
+    _worker = (shaper, features, serialize_options)
+
+
+def _shape_in_worker(text):
+    shaper, features, serialize_options = _worker
+    return shaper.shape_text(text, features, serialize_options)
+
+
 def _script_direction(script):
     if script in [
         "Arabic",
@@ -1,23 +1,54 @@
 import copy
+from fontFeatures.shaperLib.Rule import _expand_slot, _referenced_classes, _classes_current
 
 def shaper_inputs(self):
     return self.input
 
 
-def _do_apply(self, buf, ix, namedclasses={}):
-    from fontFeatures.shaperLib.Rule import _expand_slot
+def compiled_mapping(self, namedclasses={}):
+    """Returns a dictionary mapping each input glyph of a single substitution
+    to its replacement, with named classes expanded, and the replacement for
+    glyphs not in the dictionary. If there is only one replacement glyph,
+    the dictionary is empty and everything is replaced by it; otherwise
+    the default is None.
+
+    As with ``compiled_slots``, the result is cached on the rule, and
+    recomputed if its slots are replaced or the named classes it uses are
+    redefined."""
+    slots = (self.input[0], self.replacement[0])
+    cached = getattr(self, "_compiled_mapping", None)
+    if cached:
+        cached_slots, classes, referenced, compiled = cached
+        if cached_slots[0] is slots[0] and cached_slots[1] is slots[1] \
+            and classes is namedclasses and _classes_current(referenced, namedclasses):
+            return compiled
+    inputs = _expand_slot(slots[0], namedclasses)
+    replacements = _expand_slot(slots[1], namedclasses)
+    mapping = {}
+    if len(replacements) == 1:
+        default = replacements[0]
+    else:
+        # Class to class; the first mention of a glyph wins
+        default = None
+        for glyph, replacement in zip(inputs, replacements):
+            mapping.setdefault(glyph, replacement)
+    referenced = _referenced_classes(slots, namedclasses)
+    self._compiled_mapping = (slots, namedclasses, referenced, (mapping, default))
+    return mapping, default
 
+
+def _do_apply(self, buf, ix, namedclasses={}):
     coverage = buf[ix : ix + len(self.input)]
     newstuff = []
     # Handle single subst first
     if len(self.input) == 1 and len(self.replacement) == 1:
-        replacements = _expand_slot(self.replacement[0], namedclasses)
-        if len(replacements) == 1:
-            buf[ix].glyph = replacements[0]
-        else:
-            inputs = _expand_slot(self.input[0], namedclasses)
-            buf[ix].glyph = replacements[inputs.index(buf[ix].glyph)]
+        mapping, default = compiled_mapping(self, namedclasses)
+        replacement = mapping.get(buf[ix].glyph, default)
+        if replacement is None:
+            raise ValueError("%s has no replacement in %s" % (buf[ix].glyph, self.asFea()))
+        buf[ix].glyph = replacement
         buf[ix].prep_glyph(buf.font)
+        buf.item_changed(ix)
         return
 
     delta = len(self.replacement) - 1
@@ -1,4 +1,4 @@
-from youseedee import ucd_data
+from fontFeatures.shaperLib.UnicodeProperties import unicode_property
 from .BaseShaper import BaseShaper
 import re
 from fontFeatures.shaperLib.Buffer import BufferItem
@@ -33,40 +33,56 @@ class SyllabicShaper(BaseShaper):
 
     def assign_category(self, item):
         # Base behavior is Indic
-        ucd = ucd_data(item.codepoint)
-        item.syllabic_category = syllabic_category_map.get(ucd.get("Indic_Syllabic_Category", "Other"),"X")
-        item.positional_category = ucd.get("Indic_Positional_Category", "x")
+        item.syllabic_category = syllabic_category_map.get(unicode_property(item.codepoint, "Indic_Syllabic_Category", "Other"),"X")
+        item.positional_category = unicode_property(item.codepoint, "Indic_Positional_Category", "x")
         item.syllabic_position = IndicPositionalCategory2IndicPosition(item.positional_category)
         self.reassign_category(item)
 
     def assign_categories(self):
-        serialized = []
-        for ix,item in enumerate(self.buffer.items):
+        for item in self.buffer.items:
             self.assign_category(item)
-            serialized.append("<"+item.syllabic_category+">("+item.positional_category+")="+str(ix))
-        return "".join(serialized)
 
     def setup_syllables(self, shaper):
-        syllable_index = 0
-        category_string = self.assign_categories()
-        self.plan.msg("Set up syllables: "+category_string)
-        while len(category_string) > 0:
-            state, end, matched_type = None, None, None
-            for syllable_type in self.syllable_types:
-                m = re.match(self.syllable_machine[syllable_type], category_string)
-                if m and len(m[0]):
-                    matched_type = syllable_type
-                    category_string = category_string[len(m[0]):]
-                    indexes = re.findall("=(\\d+)", m[0])
-                    start, end = int(indexes[0]), int(indexes[-1])
-                    break
-            assert(matched_type)
-            for i in range(start, end+1):
+        self.assign_categories()
+        if self.plan.tracing():
+            category_string = "".join(
+                "<"+item.syllabic_category+">("+item.positional_category+")="+str(ix)
+                for ix, item in enumerate(self.buffer.items)
+            )
+            self.plan.msg("Set up syllables: "+category_string)
+        for syllable_index, (start, end, syllable_type) in enumerate(self.find_syllables()):
+            for i in range(start, end):
                 self.buffer.items[i].syllable_index = syllable_index
                 self.buffer.items[i].syllable = syllable_type
-            syllable_index = syllable_index+1
         self.plan.msg("Syllables", self.buffer, ["syllable_index", "syllable"])
 
+    def find_syllables(self):
+        """Splits the buffer into syllables, returning a list of (start, end,
+        syllable type) tuples, where end is exclusive.
+
+        At each position the syllable types are tried in the order given in
+        ``syllable_types``, and the first to match at least one item wins."""
+        matcher, patterns, tokens, other = _compiled_syllable_machine(type(self))
+        category_string = "".join(tokens.get(item.syllabic_category, other) for item in self.buffer.items)
+        syllables = []
+        pos = 0
+        while pos < len(category_string):
+            m = matcher.match(category_string, pos)
+            assert(m)
+            matched_type = int(m.lastgroup[1:])
+            end = m.end()
+            if end == pos:
+                # Syllable types which match nothing are skipped
+                for matched_type in range(matched_type+1, len(patterns)):
+                    m = patterns[matched_type].match(category_string, pos)
+                    if m and m.end() > pos:
+                        end = m.end()
+                        break
+                assert(end > pos)
+            syllables.append((pos, end, self.syllable_types[matched_type]))
+            pos = end
+        return syllables
+
     def iterate_syllables(self):
         ix = 0
         while ix < len(self.buffer.items):
@@ -111,3 +127,31 @@ class SyllabicShaper(BaseShaper):
     def final_reordering_syllable(self, start, end):
         pass
 
+
+_syllable_machines = {}
+
+def _compiled_syllable_machine(shaper_class):
+    # The syllable machines match strings of "<category>(position)=index"
+    # tokens. Rewrite them to match strings with one character for each
+    # item, and combine the syllable types into one pattern which tries
+    # each in turn.
+    machine, types = shaper_class.syllable_machine, shaper_class.syllable_types
+    cached = _syllable_machines.get(shaper_class)
+    if cached and cached[0] is machine and cached[1] == types:
+        return cached[2]
+    tail = re.escape(r'\([^\)]+\)=\d+')
+    tokens = {}
+    def token(m):
+        if m[1] not in tokens:
+            tokens[m[1]] = chr(0xE000 + len(tokens))
+        return re.escape(tokens[m[1]])
+    patterns = []
+    for syllable_type in types:
+        pattern = machine[syllable_type].replace(r'<[^\>]+>\([^\)]+\)=\d+', '.')
+        pattern = re.sub('<([^>]+)>' + tail, token, pattern)
+        patterns.append(pattern)
+    other = chr(0xE000 + len(tokens))
+    matcher = re.compile("|".join("(?P<t%i>%s)" % (ix, p) for ix, p in enumerate(patterns)), re.DOTALL)
+    compiled = (matcher, [re.compile(p, re.DOTALL) for p in patterns], tokens, other)
+    _syllable_machines[shaper_class] = (machine, list(types), compiled)
+    return compiled
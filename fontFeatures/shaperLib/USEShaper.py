@@ -1,4 +1,5 @@
-from youseedee import ucd_data, database
+from youseedee import database
+from fontFeatures.shaperLib.UnicodeProperties import unicode_property
 from .SyllabicShaper import SyllabicShaper
 from .IndicShaperData import make_syllable_machine
 from fontFeatures.shaperLib.Buffer import BufferItem
@@ -70,7 +71,7 @@ class USEShaper(SyllabicShaper):
         shaper.add_features(*self.other_features)
 
     def assign_category(self, item):
-        item.syllabic_category = ucd_data(item.codepoint).get("USE_Category", "X")
+        item.syllabic_category = unicode_property(item.codepoint, "USE_Category", "X")
         # Separate positional categories are not used, it's all in the syllabic_category
         item.positional_category = "x"
 
@@ -89,7 +90,7 @@ class USEShaper(SyllabicShaper):
             else:
                 limit = min(3, end - start)
             for i in range(start, end):
-                self.buffer.items[i].feature_masks["rphf"] = i > start + limit
+                self.buffer.items[i].mask_feature("rphf", i > start + limit)
 
     def clear_substitution(self, shaper):
         for i in self.buffer.items:
@@ -173,7 +174,7 @@ class USEShaper(SyllabicShaper):
             b = newunicodes[ix + 1]
             s = chr(a) + chr(b)
             composed = unicodedata.normalize("NFC", s)
-            if ucd_data(a)["General_Category"][0] == "M":
+            if unicode_property(a, "General_Category")[0] == "M":
                 newstring = newstring + chr(a)
                 ix = ix + 1
                 continue
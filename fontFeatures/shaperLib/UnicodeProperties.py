@@ -0,0 +1,60 @@
+"""Unicode character properties used by the shapers.
+
+youseedee's ``ucd_data`` looks a codepoint up in every file of the Unicode
+Character Database, parsing all of them on its first call, and builds a new
+dictionary of everything it found each time. The shapers only want one or
+two properties at a time, for every character of every buffer, so here we
+read just the file a property comes from, and remember the answer for each
+codepoint."""
+
+from youseedee import database
+from fontTools.unicodedata import script_name
+
+# Which UCD file each property lives in, and its value for codepoints the
+# file doesn't mention.
+properties = {
+    "General_Category": ("UnicodeData.txt", "Cn"),
+    "Script": ("Scripts.txt", "Unknown"),
+    "Script_Extensions": ("ScriptExtensions.txt", None),
+    "Joining_Type": ("ArabicShaping.txt", None),
+    "Joining_Group": ("ArabicShaping.txt", None),
+    "Indic_Syllabic_Category": ("IndicSyllabicCategory.txt", "Other"),
+    "Indic_Positional_Category": ("IndicPositionalCategory.txt", None),
+    "USE_Category": ("USECategory.txt", None),
+}
+
+_values = {name: {} for name in properties}
+_missing = object()
+
+
+def unicode_property(codepoint, name, default=_missing):
+    """Returns the value of the named Unicode property for the codepoint.
+
+    If the codepoint has no value for the property, returns ``default`` if
+    one is given, or otherwise the Unicode default value (which is None for
+    properties which don't have one)."""
+    values = _values[name]
+    value = values.get(codepoint, _missing)
+    if value is _missing:
+        filename = properties[name][0]
+        data = database[filename]["datareader"](filename, codepoint)
+        value = values[codepoint] = data.get(name)
+    if value is None:
+        if default is _missing:
+            return properties[name][1]
+        return default
+    return value
+
+
+_extensions = {}
+
+
+def script_extensions(codepoint):
+    """Returns the set of scripts a character is used with besides its own,
+    by the same names as the Script property."""
+    extensions = _extensions.get(codepoint)
+    if extensions is None:
+        codes = unicode_property(codepoint, "Script_Extensions", "")
+        extensions = frozenset(script_name(code) for code in codes.split())
+        _extensions[codepoint] = extensions
+    return extensions
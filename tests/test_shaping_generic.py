@@ -1,4 +1,4 @@
-from fontFeatures import FontFeatures, Substitution, Routine
+from fontFeatures import FontFeatures, Substitution, Routine, Chaining, RoutineReference, Attachment
 from fontFeatures.shaperLib.Buffer import Buffer
 from fontFeatures.shaperLib.Shaper import Shaper
 from babelfont import Babelfont
@@ -29,3 +29,375 @@ def test_namedclass_in_slot():
     r.addRule( Substitution( [["G", "@AB"]], [["X"]] ) )
     r.apply_to_buffer(buf, namedclasses={"AB": ["A","B"]})
     assert buf.serialize(position=False) == "X|X|C"
+
+
+def test_rule_order_with_coverage_index():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    r = Routine()
+    r.addRule( Substitution( [["B"]], [["Y"]] ) )
+    r.addRule( Substitution( [["A"]], [["X"]] ) )
+    r.addRule( Substitution( [["A", "B"]], [["Z"]] ) )
+    buf = Buffer(font, glyphs=["A", "B", "C"])
+    r.apply_to_buffer(buf)
+    assert buf.serialize(position=False) == "X|Y|C"
+    # Rules added after the routine has been applied are picked up
+    r.addRule( Substitution( [["C"]], [["Z"]] ) )
+    buf = Buffer(font, glyphs=["A", "B", "C"])
+    r.apply_to_buffer(buf)
+    assert buf.serialize(position=False) == "X|Y|Z"
+
+
+def test_namedclass_redefinition():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    namedclasses = {"AB": ("A", "B")}
+    r = Routine()
+    r.addRule( Substitution( [["@AB"]], [["X"]], postcontext=[["@AB"]] ) )
+    buf = Buffer(font, glyphs=["A", "B", "C"])
+    r.apply_to_buffer(buf, namedclasses=namedclasses)
+    assert buf.serialize(position=False) == "X|B|C"
+    namedclasses["AB"] = ("B", "C")
+    buf = Buffer(font, glyphs=["A", "B", "C"])
+    r.apply_to_buffer(buf, namedclasses=namedclasses)
+    assert buf.serialize(position=False) == "A|X|C"
+
+
+def test_masks_follow_substitutions():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    buf = Buffer(font, glyphs=["A", "acutecomb", "B", "C"])
+    buf.set_mask(0x8)  # IgnoreMarks
+    assert [x.glyph for x in buf[0:3]] == ["A", "B", "C"]
+    buf[0:2] = Buffer(font, glyphs=["X"]).items
+    assert buf.serialize(position=False) == "X|acutecomb|C"
+    assert [x.glyph for x in buf[0:2]] == ["X", "C"]
+    buf.set_mask(0)
+    assert [x.glyph for x in buf[0:3]] == ["X", "acutecomb", "C"]
+
+
+def test_update_touched_recategorizes():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    buf = Buffer(font, glyphs=["A", "B", "C"])
+    buf.set_mask(0x8)  # IgnoreMarks
+    new = Buffer(font, glyphs=["B"]).items[0]
+    new.glyph = "acutecomb"  # Changed without recategorizing
+    buf[1:2] = [new]
+    assert len(buf) == 3
+    buf.update_touched()
+    assert buf.items[1].category[0] == "mark"
+    assert [x.glyph for x in buf[0:2]] == ["A", "C"]
+
+
+def test_face_lookups():
+    from fontFeatures.shaperLib.Face import Face
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    face = Face.for_font(font)
+    assert Face.for_font(font) is face
+    assert face.gid("A") == font.glyphOrder.index("A")
+    assert face.gid("nonexistent") == -1
+    assert face.advance("A") == font["A"].width
+    assert face.category("A") == font["A"].category
+    buf = Buffer(font, glyphs=["A", "nonexistent"])
+    assert buf[0].gid == face.gid("A")
+    assert buf[0].position.xAdvance == font["A"].width
+    assert buf[1].gid == -1
+
+
+def test_tracing_only_when_listened_to():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    ff = FontFeatures()
+    r = Routine(name="test")
+    r.addRule( Substitution( [["A"]], [["X"]] ) )
+    ff.addFeature("liga", [r])
+
+    messages = []
+    shaper = Shaper(ff, font, message_function=lambda msg, buffer=None, serialize_options=None: messages.append(msg))
+    assert shaper.tracing()
+    shaper.execute(Buffer(font, glyphs=["A", "B"], direction="LTR"))
+    assert "Before test (liga)" in messages
+    assert "After test (liga)" in messages
+
+    class UnserializableBuffer(Buffer):
+        def serialize(self, *args, **kwargs):
+            raise AssertionError("Serialized buffer with nobody listening")
+
+    shaper = Shaper(ff, font)
+    assert not shaper.tracing()
+    buf = UnserializableBuffer(font, glyphs=["A", "B"], direction="LTR")
+    shaper.execute(buf)
+    assert [x.glyph for x in buf] == ["X", "B"]
+
+
+def test_shape_plan_cache():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    ff = FontFeatures()
+    r = Routine(name="test")
+    r.addRule( Substitution( [["A"]], [["X"]] ) )
+    ff.addFeature("liga", [r])
+    shaper = Shaper(ff, font)
+
+    buf = shaper.execute(Buffer(font, glyphs=["A", "B"], direction="LTR"))
+    assert buf.serialize(position=False) == "X|B"
+    plan = shaper.shape_plan
+    buf = shaper.execute(Buffer(font, glyphs=["B", "A"], direction="LTR"))
+    assert buf.serialize(position=False) == "B|X"
+    assert shaper.shape_plan is plan
+
+    buf = shaper.execute(Buffer(font, glyphs=["A", "B"], direction="LTR"), features="-liga")
+    assert buf.serialize(position=False) == "A|B"
+    assert shaper.shape_plan is not plan
+    assert len(shaper.plans) == 2
+
+
+def test_shape_many():
+    from fontFeatures.ttLib import unparse
+    from fontTools.ttLib import TTFont
+    fontfile = "tests/data/LibertinusSans-Regular.otf"
+    font = Babelfont.load(fontfile)
+    shaper = Shaper(unparse(TTFont(fontfile)), font)
+    texts = ["AVA", "office", "Tyo"]
+    expected = [shaper.shape_text(t) for t in texts]
+    assert list(shaper.shape_many(texts)) == expected
+    assert list(shaper.shape_many(texts, workers=2, fontfile=fontfile)) == expected
+    with pytest.raises(ValueError):
+        shaper.shape_many(texts, workers=2)
+
+
+def test_word_cache():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    ff = FontFeatures()
+    r = Routine(name="test")
+    r.addRule( Substitution( [["A"]], [["X"]] ) )
+    ff.addFeature("liga", [r])
+    shaper = Shaper(ff, font, word_cache_size=1)
+
+    first = shaper.execute(Buffer(font, glyphs=["A", "B"], direction="LTR"))
+    first.items[0].position.xAdvance = 0
+    second = shaper.execute(Buffer(font, glyphs=["A", "B"], direction="LTR"))
+    assert second.serialize(position=False) == "X|B"
+    assert second.items[0].position.xAdvance == font["X"].width
+    assert (shaper.word_cache.hits, shaper.word_cache.misses) == (1, 1)
+
+    shaper.execute(Buffer(font, glyphs=["B", "A"], direction="LTR"))
+    assert shaper.word_cache.evictions == 1
+    shaper.execute(Buffer(font, glyphs=["A", "B"], direction="LTR"), features="-liga")
+    assert shaper.word_cache.misses == 3
+
+
+def test_buffer_item_copy():
+    import copy
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    buf = Buffer(font, glyphs=["A"])
+    item = buf.items[0]
+    assert not hasattr(item, "syllable_index")
+    item.syllable_index = 3
+    new = copy.copy(item)
+    assert new is not item
+    assert (new.glyph, new.gid, new.category, new.syllable_index) == ("A", item.gid, item.category, 3)
+    assert new.position.xAdvance == font["A"].width
+    new.syllable_index = 4
+    assert item.syllable_index == 3
+
+
+def test_chaining_nested_lookups():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    nested = Routine(name="nested")
+    nested.addRule( Substitution( [["C"]], [["D"]] ) )
+    nested.addRule( Substitution( [["A"]], [["B"]] ) )
+    nested.addRule( Substitution( [["B"]], [["C"]] ) )
+    r = Routine()
+    r.addRule( Chaining( [["A"]], postcontext=[["E"]], lookups=[[RoutineReference(routine=nested)]] ) )
+    buf = Buffer(font, glyphs=["A", "E", "A", "F"])
+    r.apply_to_buffer(buf)
+    # Later rules in the nested routine see the result of earlier ones
+    assert buf.serialize(position=False) == "C|E|A|F"
+
+
+def test_mark_attachment_base_search():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    r = Routine()
+    r.addRule( Attachment("top", "_top", bases={"A": (300, 700)}, marks={"acutecomb": (100, 500), "gravecomb": (50, 500)}) )
+    buf = Buffer(font, glyphs=["A", "gravecomb", "acutecomb", "B", "acutecomb"])
+    r.apply_to_buffer(buf, stage="pos")
+    assert (buf[1].attach_chain, buf[2].attach_chain) == (-1, -2)
+    assert (buf[2].position.xPlacement, buf[2].position.yPlacement) == (200, 200)
+    # B isn't one of our bases, and we can't skip over it to get to A
+    assert not hasattr(buf[4], "attach_chain")
+
+
+def test_long_cursive_chain():
+    from fontFeatures.shaperLib.BaseShaper import BaseShaper
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    buf = Buffer(font, glyphs=["A"] * 3000, direction="RTL")
+    for ix, item in enumerate(buf.items):
+        item.position.yPlacement = 1
+        if ix:
+            item.attach_type = "cursive"
+            item.attach_chain = -1
+    BaseShaper(None, font, buf).propagate_attachment_offsets()
+    assert [x.position.yPlacement for x in buf.items[:3]] == [1, 2, 3]
+    assert buf.items[-1].position.yPlacement == 3000
+
+
+def test_find_syllables():
+    from fontFeatures.shaperLib.IndicShaper import IndicShaper
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    buf = Buffer(font, glyphs=["A"] * 9)
+    for item, category in zip(buf.items, ["C", "H", "C", "M", "V", "N", "X", "M", "H"]):
+        item.syllabic_category = category
+    shaper = IndicShaper(None, font, buf)
+    assert shaper.find_syllables() == [
+        (0, 4, "consonant_syllable"),
+        (4, 6, "vowel_syllable"),
+        (6, 7, "other"),
+        (7, 9, "broken_cluster"),
+    ]
+
+
+def test_consonant_positions_are_remembered():
+    from fontFeatures.shaperLib.IndicShaper import IndicShaper
+    from fontFeatures.shaperLib.IndicShaperData import IndicPosition
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    plan = Shaper(FontFeatures(), font)
+    probes = []
+    for _ in range(2):
+        shaper = IndicShaper(plan, font, Buffer(font, glyphs=["A"], script="Devanagari"))
+        shaper.would_substitute = lambda feature, items: probes.append(feature)
+        assert shaper.consonant_position_from_face(0x915) == IndicPosition.BASE_C
+    assert len(probes) == 8
+
+
+def test_unicode_properties():
+    from fontFeatures.shaperLib.UnicodeProperties import unicode_property, _values
+
+    assert unicode_property(0x0915, "USE_Category") == "B"
+    assert unicode_property(0x0041, "USE_Category") is None
+    assert unicode_property(0x0041, "USE_Category", "X") == "X"
+    assert _values["USE_Category"][0x0915] == "B"
+
+
+def test_vowel_constraints():
+    from fontFeatures.shaperLib.VowelConstraints import preprocess_text_vowel_constraints
+
+    buf = Buffer(None, unicodes="अार्इक", script="Devanagari", direction="LTR")
+    preprocess_text_vowel_constraints(buf)
+    assert [x.codepoint for x in buf.items] == [0x0905, 0x25CC, 0x093E, 0x0930, 0x094D, 0x25CC, 0x0907, 0x0915]
+
+
+def test_feature_masks():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    buf = Buffer(font, glyphs=["A", "B", "C"])
+    buf.items[1].mask_feature("init")
+    buf.items[2].mask_feature("fina")
+    buf.items[2].mask_feature("fina", False)
+    buf.set_feature_mask("init")
+    assert buf.mask == [0, 2]
+    buf.set_feature_mask("fina")
+    assert buf.mask == [0, 1, 2]
+
+
+def test_glyph_digest():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    a_to_c = Routine()
+    a_to_c.addRule( Substitution( [["A"]], [["C"]] ) )
+    c_to_d = Routine()
+    c_to_d.addRule( Substitution( [["C"]], [["D"]] ) )
+    buf = Buffer(font, glyphs=["A", "B"])
+    buf.start_glyph_digest()
+    masks = buf._masks
+    c_to_d.apply_to_buffer(buf)
+    # Skipped without even looking at the buffer
+    assert buf._masks is masks
+    a_to_c.apply_to_buffer(buf)
+    c_to_d.apply_to_buffer(buf)
+    assert buf.serialize(position=False) == "D|B"
+
+
+def test_substitution_mappings():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    r = Routine()
+    r.addRule( Substitution( [["A", "B", "A"]], [["C", "D", "E"]] ) )
+    buf = Buffer(font, glyphs=["A", "B", "F"])
+    r.apply_to_buffer(buf)
+    assert buf.serialize(position=False) == "C|D|F"
+
+    ligatures = Routine()
+    ligatures.addRule( Substitution( [["f"], ["f"], ["i"]], [["f_f_i"]] ) )
+    ligatures.addRule( Substitution( [["f"], ["f"]], [["f_f"]] ) )
+    ligatures.addRule( Substitution( [["f"], ["i"]], [["fi"]] ) )
+    buf = Buffer(font, glyphs=["f", "f", "i", "f", "f", "f", "i"])
+    ligatures.apply_to_buffer(buf)
+    assert buf.serialize(position=False) == "f_f_i|f_f|fi"
+
+
+def test_itemize():
+    from fontFeatures.shaperLib.Itemizer import itemize
+
+    text = "abc, عربي ١٢ मनक।"
+    runs = [(text[start:end], script, direction) for start, end, script, direction in itemize(text)]
+    assert runs == [
+        ("abc, ", "Latin", "LTR"),
+        ("عربي ١٢ ", "Arabic", "RTL"),
+        ("मनक।", "Devanagari", "LTR"),
+    ]
+
+
+def test_shape_stream():
+    from fontFeatures.ttLib import unparse
+    from fontTools.ttLib import TTFont
+    fontfile = "tests/data/LibertinusSans-Regular.otf"
+    shaper = Shaper(unparse(TTFont(fontfile)), Babelfont.load(fontfile))
+    chunks = ["AVA\nof", "fice\r", "\n\nTyo"]
+    expected = [shaper.shape_text(t) for t in ["AVA", "office", "", "Tyo"]]
+    assert list(shaper.shape_stream(chunks)) == expected
+
+
+def test_shape_text_clusters():
+    import re
+    from fontFeatures.ttLib import unparse
+    from fontTools.ttLib import TTFont
+    fontfile = "tests/data/LibertinusSans-Regular.otf"
+    shaper = Shaper(unparse(TTFont(fontfile)), Babelfont.load(fontfile))
+    text = "ab αβ cd"
+    starts = [start for start, buf in shaper.shape_runs(text)]
+    assert starts == [0, 3, 6]
+    clusters = [int(c) for c in re.findall(r"=(\d+)", shaper.shape_text(text))]
+    assert clusters == list(range(len(text)))
+
+
+def test_contextual_rule_matching():
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    r = Routine()
+    r.addRule( Substitution( [["B"]], [["X"]], precontext=[["A"]], postcontext=[["C"], ["D"]] ) )
+    r.addRule( Substitution( [["B"]], [["Y"]], precontext=[["A"]], postcontext=[["C"]] ) )
+    r.addRule( Substitution( [["B"]], [["Z"]], postcontext=[["E"]] ) )
+    buf = Buffer(font, glyphs=["A", "B", "C", "E", "B", "C", "D", "B", "E"])
+    r.apply_to_buffer(buf)
+    assert buf.serialize(position=False) == "A|Y|C|E|B|C|D|Z|E"
+
+
+def test_glyph_names_are_shared():
+    from fontFeatures.shaperLib.Rule import compiled_slots
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    name = "".join(["A", "B"])
+    rule = Substitution( [[name]], [["C"]] )
+    buf = Buffer(font, glyphs=["".join(["A", "B"])])
+    [slot] = compiled_slots(rule)[1]
+    assert next(iter(slot)) is buf.items[0].glyph
+
+
+def test_pair_positioning():
+    from fontFeatures import Positioning, ValueRecord
+    font = Babelfont.load("tests/data/LibertinusSans-Regular.otf")
+    r = Routine()
+    r.addRule( Positioning( [["A"], ["V"]], [ValueRecord(xAdvance=-10), ValueRecord()] ) )
+    r.addRule( Positioning( [["A", "T"], ["V", "o"]], [ValueRecord(xAdvance=-20), ValueRecord()] ) )
+    buf = Buffer(font, glyphs=["A", "V", "A", "o", "T", "V", "V", "A"])
+    r.apply_to_buffer(buf)
+    widths = [item.position.xAdvance - font[item.glyph].width for item in buf]
+    assert widths == [-10, 0, -20, 0, -20, 0, 0, 0]
+    # Glyphs are skipped by the rules' flags, not the routine's
+    r = Routine(flags=0x8)
+    r.addRule( Positioning( [["A"], ["V"]], [ValueRecord(xAdvance=-10), ValueRecord()] ) )
+    buf = Buffer(font, glyphs=["A", "acutecomb", "V"])
+    r.apply_to_buffer(buf)
+    widths = [item.position.xAdvance - font[item.glyph].width for item in buf]
+    assert widths == [0, 0, 0]